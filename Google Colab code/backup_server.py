@@ -3,116 +3,316 @@
 # ==============================================================================
 # TRY THIS ONE IF THE soverign_server.py FAILS TO INSTALL OLLAMA
 # ==============================================================================
+# Same fast start as sovereign_server.py (steps run as soon as what they need is ready,
+# readiness is polled, the model is pre-loaded, READY_FILE gets the URL + timings),
+# but Ollama is installed verbosely, with zstd, and located on disk afterwards.
+# ==============================================================================
 
+import json
 import os
 import subprocess
-import time
 import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future, wait, FIRST_EXCEPTION
+
+MODEL_NAME = "qwen2.5:14b"
+KEEP_ALIVE = "30m"          # how long the pre-loaded model stays in VRAM (the client sends the same)
+OLLAMA_PORT = 11434
+OLLAMA_URL = f"http://localhost:{OLLAMA_PORT}"
+READY_FILE = "sovereign_ready.json"
+
+# OPTIONAL PRIORITY GATEWAY (see priority_gateway.py, save it with %%writefile first):
+# robot calls jump ahead of long essays, and the queue is bounded. The tunnel then points at the gateway.
+USE_GATEWAY = False
+GATEWAY_PORT = 11435
+GATEWAY_CONCURRENCY = 1     # requests the GPU runs at once (a 14B model on a T4: 1), also given to Ollama
+GATEWAY_MAX_QUEUE = 32      # requests allowed to wait before the lowest priority ones are shed
+
+# Shell commands used by the steps (swap them for fakes to test the pipeline)
+# {ollama} is replaced by the located executable
+COMMANDS = {
+    "install_pyngrok": "pip install pyngrok",
+    # Install zstd, a dependency for Ollama
+    "install_zstd": "sudo apt-get update && sudo apt-get install -y zstd",
+    # Use `sh -s -- -y` to non-interactively install, agreeing to prompts.
+    # This typically installs to /usr/local/bin
+    "install_ollama": "curl -fsSL https://ollama.com/install.sh | sh -s -- -y",
+    "which_ollama": "which ollama",
+    "kill_ollama": "pkill -f {ollama}",
+    "ollama_running": "pgrep -x ollama",
+    "serve": "{ollama} serve",
+    "kill_gateway": "pkill -f '[p]riority_gateway.py'",
+    "gateway": "python3 priority_gateway.py --port {port} --concurrency {concurrency} --max-queue {max_queue}",
+    "pull": "{ollama} pull {model}",
+}
+OLLAMA_EXECUTABLE = "/usr/local/bin/ollama"
+
+# Max seconds to wait for each readiness check
+TIMEOUTS = {"ollama_stopped": 15, "ollama_up": 60, "gateway_up": 30, "warm": 600}
+
+
+# ==============================================================================
+#                               PIPELINE HELPERS
+# ==============================================================================
+class Step:
+    """One provisioning step: run(ctx) starts once every step named in `needs` has finished."""
+    def __init__(self, name, run, needs=()):
+        self.name = name
+        self.run = run
+        self.needs = tuple(needs)
+
+
+def run_pipeline(steps, ctx):
+    """
+    Runs every step as soon as the steps it needs are done (independent steps at the same time).
+    Returns {step: {"start", "end", "seconds"}} relative to the start.
+    Raises the first step failure as soon as it happens, without waiting for the steps still running.
+    """
+    started = time.perf_counter()
+    timings = {}
+    futures = {}
+
+    def run_step(step):
+        for name in step.needs:
+            futures[name].result()  # waits; re-raises if a needed step failed
+        start = time.perf_counter() - started
+        step.run(ctx)
+        end = time.perf_counter() - started
+        timings[step.name] = {"start": round(start, 2), "end": round(end, 2), "seconds": round(end - start, 2)}
+
+    def start_thread(step):
+        future = Future()
+
+        def target():
+            try:
+                future.set_result(run_step(step))
+            except BaseException as e:
+                future.set_exception(e)
+        # Daemon: after a failure, a long install or download still running doesn't hold up the exit
+        threading.Thread(target=target, name=step.name, daemon=True).start()
+        return future
 
-# --- 1. PROVISIONING & INSTALLATION ---
-print("⚙️ [1/5] Installing Dependencies (Ollama & Ngrok)...")
+    # One thread per step, so a step waiting on its needs never blocks another one
+    for step in steps:  # listed in dependency order
+        futures[step.name] = start_thread(step)
+    wait(list(futures.values()), return_when=FIRST_EXCEPTION)
+    for step in steps:
+        future = futures[step.name]
+        if future.done() and future.exception() is not None:
+            raise future.exception()
+    return timings
 
-# Install pyngrok
-pyngrok_install_cmd = "pip install pyngrok"
-print(f"   -> Running: {pyngrok_install_cmd}")
-if subprocess.run(pyngrok_install_cmd, shell=True).returncode != 0:
-    print("❌ Failed to install pyngrok")
-    sys.exit(1)
-else:
+
+def wait_until(check, timeout, what, interval=0.25):
+    """Polls check() until it returns True (instead of sleeping a fixed time)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return
+        time.sleep(interval)
+    raise TimeoutError(f"Timed out after {timeout}s waiting for {what}")
+
+
+def sh(command, **kwargs):
+    """Runs a shell command, raising (with its output, if captured) if it fails."""
+    print(f"   -> Running: {command}")
+    result = subprocess.run(command, shell=True, **kwargs)
+    if result.returncode != 0:
+        details = f"\nSTDOUT: {result.stdout}\nSTDERR: {result.stderr}" if kwargs.get("capture_output") else ""
+        raise RuntimeError(f"Command failed: {command}{details}")
+    return result
+
+
+def answers(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def ollama_is_up():
+    return answers(OLLAMA_URL + "/api/tags")
+
+
+# ==============================================================================
+#                                   STEPS
+# ==============================================================================
+def install_pyngrok(ctx):
+    sh(COMMANDS["install_pyngrok"])
     print("   -> pyngrok installed.")
 
-# Install zstd, a dependency for Ollama
-print("   -> Installing zstd...")
-if subprocess.run("sudo apt-get update && sudo apt-get install -y zstd", shell=True).returncode != 0:
-    print("❌ Failed to install zstd")
-    sys.exit(1)
-else:
+
+def install_zstd(ctx):
+    sh(COMMANDS["install_zstd"])
     print("   -> zstd installed.")
 
-# Install Ollama (Make it verbose to check for errors)
-print("   -> Installing Ollama...")
-# Use `sh -s -- -y` to non-interactively install, agreeing to prompts.
-# This typically installs to /usr/local/bin
-install_ollama_cmd = "curl -fsSL https://ollama.com/install.sh | sh -s -- -y"
-install_result = subprocess.run(install_ollama_cmd, shell=True, capture_output=True, text=True)
-
-if install_result.returncode != 0:
-    print("❌ Failed to install Ollama.")
-    print("STDOUT:", install_result.stdout)
-    print("STDERR:", install_result.stderr)
-    sys.exit(1)
-else:
+
+def install_ollama(ctx):
+    # Make it verbose to check for errors
+    sh(COMMANDS["install_ollama"], capture_output=True, text=True)
     print("   -> Ollama installation successful.")
-    # print("STDOUT:", install_result.stdout) # Uncomment for more verbose output if needed
-    # print("STDERR:", install_result.stderr)
-
-# Determine the full path to the ollama executable
-ollama_executable = "/usr/local/bin/ollama"
-# Verify if it exists, if not, try to find it (though /usr/local/bin is standard)
-if not os.path.exists(ollama_executable):
-    print(f"⚠️ Warning: Ollama not found at expected path {ollama_executable}. Attempting to locate.")
-    try:
+
+    # Determine the full path to the ollama executable
+    ctx["ollama"] = OLLAMA_EXECUTABLE
+    # Verify if it exists, if not, try to find it (though /usr/local/bin is standard)
+    if not os.path.exists(OLLAMA_EXECUTABLE):
+        print(f"⚠️ Warning: Ollama not found at expected path {OLLAMA_EXECUTABLE}. Attempting to locate.")
         # Use 'which' to find the executable in the PATH
-        which_result = subprocess.run("which ollama", shell=True, capture_output=True, text=True, check=True)
-        ollama_executable = which_result.stdout.strip()
-        print(f"   -> Found Ollama at: {ollama_executable}")
-    except subprocess.CalledProcessError:
-        print("❌ Could not locate Ollama executable after installation. Please check the installation logs.")
-        sys.exit(1)
+        found = subprocess.run(COMMANDS["which_ollama"], shell=True, capture_output=True, text=True)
+        if found.returncode != 0 or not found.stdout.strip():
+            raise RuntimeError("Could not locate Ollama executable after installation. Please check the installation logs.")
+        ctx["ollama"] = found.stdout.strip()
+        print(f"   -> Found Ollama at: {ctx['ollama']}")
+
+
+def stop_old_ollama(ctx):
+    # Kill any existing Ollama processes to prevent conflicts, and wait until they are really gone
+    subprocess.run(COMMANDS["kill_ollama"].format(ollama=ctx["ollama"]), shell=True)
+    running = COMMANDS["ollama_running"].format(ollama=ctx["ollama"])
+    wait_until(lambda: subprocess.run(running, shell=True, stdout=subprocess.DEVNULL).returncode != 0,
+               TIMEOUTS["ollama_stopped"], "old Ollama to exit")
+
+
+def start_ollama(ctx):
+    print("🚀 Spinning up Ollama Engine (Background)...")
+    # Allow external connections (Fixes 403 Forbidden)
+    env = dict(os.environ, OLLAMA_ORIGINS="*", OLLAMA_HOST="0.0.0.0")
+    if USE_GATEWAY:
+        # Ollama runs exactly as many requests at once as the gateway lets through
+        env["OLLAMA_NUM_PARALLEL"] = str(GATEWAY_CONCURRENCY)
+    ctx["process"] = subprocess.Popen(COMMANDS["serve"].format(ollama=ctx["ollama"]), shell=True, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def ready():
+        if ctx["process"].poll() is not None:
+            raise RuntimeError("ollama serve exited during startup")
+        return ollama_is_up()
+
+    wait_until(ready, TIMEOUTS["ollama_up"], "Ollama to answer")
+    print("   -> Ollama Engine is up.")
+
 
-# --- 2. AUTHENTICATION ---
-print("🔑 [2/5] Authenticating Ngrok...")
-from google.colab import userdata
-from pyngrok import ngrok
-
-try:
-    token = userdata.get('NGROK_TOKEN')
-    print("   -> Token retrieved from Secrets Manager.")
-except:
-    token = input("   -> Secrets not found. Paste Ngrok Token here: ")
-
-ngrok.set_auth_token(token)
-
-# --- 3. CONFIGURATION (CORS & PORTS) ---
-print("🛡️ [3/5] Configuring Network Permissions...")
-# Kill any existing Ollama processes to prevent conflicts
-# Use the determined ollama_executable for pkill
-subprocess.run(f"pkill -f {ollama_executable}", shell=True)
-time.sleep(2)
-
-# Set Environment Variables to allow external connections (Fixes 403 Forbidden)
-os.environ["OLLAMA_ORIGINS"] = "*"
-os.environ["OLLAMA_HOST"] = "0.0.0.0"
-
-# --- 4. STARTING THE ENGINE ---
-print("🚀 [4/5] Spinning up Ollama Engine (Background)...")
-process = subprocess.Popen(
-    [ollama_executable, "serve"],
-    stdout=subprocess.DEVNULL,
-    stderr=subprocess.DEVNULL
-)
-time.sleep(5) # Allow warmup
-
-# Open the Tunnel
-try:
-    # Kill old tunnels
+def start_gateway(ctx):
+    print("🚦 Starting Priority Gateway...")
+    if not os.path.exists("priority_gateway.py"):
+        raise RuntimeError("USE_GATEWAY is on but priority_gateway.py is missing (save it with %%writefile first)")
+    # A gateway left over from an earlier run would still hold the port
+    subprocess.run(COMMANDS["kill_gateway"], shell=True)
+    status_url = f"http://localhost:{GATEWAY_PORT}/gateway/status"
+    wait_until(lambda: not answers(status_url), TIMEOUTS["gateway_up"], "the old gateway to exit")
+    command = COMMANDS["gateway"].format(port=GATEWAY_PORT, concurrency=GATEWAY_CONCURRENCY,
+                                         max_queue=GATEWAY_MAX_QUEUE)
+    ctx["gateway"] = subprocess.Popen(command, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def ready():
+        if ctx["gateway"].poll() is not None:
+            raise RuntimeError("priority gateway exited during startup")
+        return answers(status_url)
+
+    wait_until(ready, TIMEOUTS["gateway_up"], "the gateway to answer")
+    print("   -> Gateway is up.")
+
+
+def ngrok_tunnel(ctx):
+    """Default tunnel: authenticates pyngrok and opens a tunnel to Ollama (or the gateway). Returns the public URL."""
+    from pyngrok import ngrok
+    ngrok.set_auth_token(ctx["token"])
+    # Kill old tunnels, then establish a new one (Ollama doesn't need to be up yet)
     ngrok.kill()
-    tunnel = ngrok.connect(11434)
-    public_url = tunnel.public_url
+    return ngrok.connect(ctx["port"]).public_url
+
+
+def open_tunnel(ctx):
+    ctx["url"] = ctx["open_tunnel"](ctx)
     print(f"   -> Tunnel Established.")
-except Exception as e:
-    print(f"❌ Tunnel Error: {e}")
-    sys.exit(1)
+    print(f"🔗 API URL: {ctx['url']}  (model still loading, wait for SYSTEM ONLINE)")
 
-# --- 5. LOADING THE BRAIN ---
-MODEL_NAME = "qwen2.5:14b"
-print(f"⬇️ [5/5] Downloading Model: {MODEL_NAME} (This takes ~2-5 mins)...")
-# We pull the model. This is the blocking step.
-# Use the determined ollama_executable for ollama pull
-subprocess.run(f"{ollama_executable} pull {MODEL_NAME}", shell=True)
-
-print("\n" + "="*60)
-print(f"✅ SYSTEM ONLINE")
-print(f"🔗 API URL: {public_url}")
-print("="*60)
-print("⚠️ COPY THE URL ABOVE INTO YOUR LOCAL CLIENT SCRIPT ⚠️")
\ No newline at end of file
+
+def pull_model(ctx):
+    print(f"⬇️ Downloading Model: {MODEL_NAME} (This takes ~2-5 mins)...")
+    sh(COMMANDS["pull"].format(ollama=ctx["ollama"], model=MODEL_NAME))
+
+
+def warm_model(ctx):
+    # A chat request with no messages just loads the model into VRAM and keeps it there
+    print("   -> Loading model into VRAM...")
+    body = json.dumps({"model": MODEL_NAME, "messages": [], "keep_alive": KEEP_ALIVE}).encode()
+    request = urllib.request.Request(OLLAMA_URL + "/api/chat", data=body,
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=TIMEOUTS["warm"]) as response:
+        response.read()
+
+
+def build_steps():
+    """The provisioning graph. Each step lists the steps it needs."""
+    steps = [
+        Step("install_pyngrok", install_pyngrok),
+        Step("install_zstd", install_zstd),
+        Step("install_ollama", install_ollama, needs=["install_zstd"]),
+        Step("stop_old_ollama", stop_old_ollama, needs=["install_ollama"]),
+        Step("tunnel", open_tunnel, needs=["install_pyngrok"]),
+        Step("start_ollama", start_ollama, needs=["stop_old_ollama"]),
+        Step("pull_model", pull_model, needs=["start_ollama"]),
+        Step("warm_model", warm_model, needs=["pull_model"]),
+    ]
+    if USE_GATEWAY:
+        steps.append(Step("start_gateway", start_gateway))
+    return steps
+
+
+def get_token():
+    """Ngrok token from Colab's Secrets Manager, or typed in."""
+    try:
+        from google.colab import userdata
+        token = userdata.get('NGROK_TOKEN')
+        print("   -> Token retrieved from Secrets Manager.")
+        return token
+    except Exception:
+        return input("   -> Secrets not found. Paste Ngrok Token here: ")
+
+
+def main(steps=None, open_tunnel=ngrok_tunnel, token=None):
+    """
+    Provisions everything and writes READY_FILE.
+    :param steps: Step list (default: build_steps()).
+    :param open_tunnel: Function(ctx) -> public URL.
+    :param token: Ngrok token (default: asked for up front, so no step has to wait on input).
+    """
+    print("🔑 Authenticating Ngrok...")
+    ctx = {"token": token if token is not None else get_token(), "open_tunnel": open_tunnel,
+           "port": GATEWAY_PORT if USE_GATEWAY else OLLAMA_PORT}
+
+    print("⚙️ Provisioning (independent steps run at the same time)...")
+    started = time.perf_counter()
+    try:
+        timings = run_pipeline(steps or build_steps(), ctx)
+    except Exception as e:
+        print(f"❌ Startup Failed: {e}")
+        sys.exit(1)
+    total = time.perf_counter() - started
+
+    ready = {
+        "url": ctx["url"],
+        "model": MODEL_NAME,
+        "keep_alive": KEEP_ALIVE,
+        "gateway": USE_GATEWAY,
+        "ready_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "total_seconds": round(total, 2),
+        "steps": timings,
+    }
+    with open(READY_FILE, "w") as f:
+        json.dump(ready, f, indent=2)
+
+    print("\n" + "="*60)
+    print(f"✅ SYSTEM ONLINE (ready in {total:.0f}s, model loaded)")
+    print(f"🔗 API URL: {ctx['url']}")
+    print("="*60)
+    print("⚠️ COPY THE URL ABOVE INTO YOUR LOCAL CLIENT SCRIPT ⚠️")
+    return ready
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# ==============================================================================
+#                      PRIORITY GATEWAY (OPTIONAL, GOOGLE COLAB)
+# ==============================================================================
+# Sits between the ngrok tunnel and Ollama, so a long study-app essay can't hold up
+# a time-critical robot planning call.
+#   ngrok --> gateway (port 11435) --> Ollama (port 11434)
+# - Priority classes: clients send "X-Priority: high | normal | low" (default normal).
+# - Fair scheduling: within a class, clients take turns (X-Client-Id, else their IP),
+#   so one client sending many requests can't starve the others.
+# - GPU-matched concurrency: only as many requests reach Ollama at once as it runs in
+#   parallel (OLLAMA_NUM_PARALLEL), the rest wait here, where priority decides the order.
+# - Bounded queue with load shedding: when the queue is full, the lowest-priority request
+#   of the busiest client is dropped (HTTP 503 + Retry-After), or the new one if nothing is lower.
+# - Every response carries "X-Queue-Wait: <seconds>", so clients can tell queueing apart
+#   from generation time. GET /gateway/status shows the queue.
+# Only generation endpoints (/api/chat, /api/generate, /api/embed...) are queued,
+# everything else (/api/tags, /api/ps) is passed straight through.
+#
+# INSTRUCTIONS:
+# 1. Put this file in a cell whose first line is:  %%writefile priority_gateway.py
+#    and run that cell (it only saves the file).
+# 2. Set USE_GATEWAY = True in sovereign_server.py and run it: it starts the gateway for you.
+# Needs aiohttp (preinstalled on Colab). Run it by hand with:
+#     python3 priority_gateway.py --port 11435 --concurrency 1 --max-queue 32
+# ==============================================================================
+
+import argparse
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+import aiohttp
+from aiohttp import web
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+QUEUED_PATHS = {"/api/chat", "/api/generate", "/api/embeddings", "/api/embed"}
+QUEUE_WAIT_HEADER = "X-Queue-Wait"
+
+# Headers that describe one HTTP hop and must not be copied to the next
+HOP_HEADERS = {"host", "content-length", "transfer-encoding", "connection", "keep-alive"}
+
+
+class Shed(Exception):
+    """The request was dropped because the queue is full."""
+
+
+class Scheduler:
+    """
+    Admission control: at most `concurrency` requests run at once, up to `max_queue` wait.
+    Waiting requests are kept per priority class, then per client (round-robin between clients).
+    Runs on a single event loop, so it needs no locks.
+    """
+    def __init__(self, concurrency=1, max_queue=32):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.queued = 0
+        # priority -> {client: deque of futures}, in round-robin order
+        self.queues = {level: OrderedDict() for level in sorted(PRIORITIES.values())}
+        self.stats = {"admitted": 0, "waited": 0, "shed": 0, "completed": 0}
+
+    async def acquire(self, priority, client):
+        """Waits for a slot. Returns the seconds spent waiting. Raises Shed if dropped."""
+        self.stats["admitted"] += 1
+        if self.running < self.concurrency and self.queued == 0:
+            self.running += 1
+            return 0.0
+
+        if self.queued >= self.max_queue:
+            self._shed_for(priority)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues[priority].setdefault(client, deque()).append(waiter)
+        self.queued += 1
+        self.stats["waited"] += 1
+        start = time.monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Client hung up while waiting: leave the queue, or hand back a slot granted meanwhile
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self.release()
+            else:
+                self._remove(priority, client, waiter)
+            raise
+        return time.monotonic() - start
+
+    def release(self):
+        """A running request finished: hand its slot to the next one in line."""
+        self.running -= 1
+        self.stats["completed"] += 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running < self.concurrency and self.queued:
+            clients = next(q for q in self.queues.values() if q)  # highest non-empty priority
+            client, waiters = next(iter(clients.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                clients.move_to_end(client)  # next turn goes to another client
+            else:
+                del clients[client]
+            self.queued -= 1
+            self.running += 1
+            waiter.set_result(None)
+
+    def _shed_for(self, priority):
+        """Frees a queue place for a new request of `priority`, or raises Shed for the new request itself."""
+        # Nothing queued (max_queue 0: no waiting at all) or nothing lower queued: the new request goes
+        lowest = max((level for level, clients in self.queues.items() if clients), default=None)
+        if lowest is None or lowest <= priority:
+            self.stats["shed"] += 1
+            raise Shed()
+        # Drop the newest request of the client with the most requests waiting in the lowest class
+        clients = self.queues[lowest]
+        client = max(clients, key=lambda c: len(clients[c]))
+        waiter = clients[client].pop()
+        if not clients[client]:
+            del clients[client]
+        self.queued -= 1
+        self.stats["shed"] += 1
+        waiter.set_exception(Shed())
+
+    def _remove(self, priority, client, waiter):
+        waiters = self.queues[priority].get(client)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            self.queued -= 1
+            if not waiters:
+                del self.queues[priority][client]
+
+    def status(self):
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": {name: sum(len(w) for w in self.queues[level].values()) for name, level in PRIORITIES.items()},
+            **self.stats,
+        }
+
+
+def make_app(upstream, concurrency=1, max_queue=32):
+    """Builds the gateway web app forwarding to the Ollama server at `upstream`."""
+    scheduler = Scheduler(concurrency, max_queue)
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app["scheduler"] = scheduler
+
+    async def open_session(app):
+        app["session"] = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None))
+
+    async def close_session(app):
+        await app["session"].close()
+
+    async def status(request):
+        return web.json_response(scheduler.status())
+
+    async def proxy(request):
+        priority = PRIORITIES.get(request.headers.get("X-Priority", "normal").lower(), PRIORITIES["normal"])
+        client = (request.headers.get("X-Client-Id")
+                  or request.headers.get("X-Forwarded-For", "").split(",")[0].strip()
+                  or request.remote)
+        body = await request.read()
+        queued = request.method == "POST" and request.path in QUEUED_PATHS
+
+        wait = 0.0
+        if queued:
+            try:
+                wait = await scheduler.acquire(priority, client)
+            except Shed:
+                return web.json_response({"error": "gateway queue full, request shed"}, status=503,
+                                         headers={"Retry-After": "1", QUEUE_WAIT_HEADER: "0.000"})
+        try:
+            headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+            async with app["session"].request(request.method, upstream + request.path_qs,
+                                              data=body, headers=headers) as upstream_response:
+                response = web.StreamResponse(status=upstream_response.status, headers={
+                    "Content-Type": upstream_response.headers.get("Content-Type", "application/json"),
+                    QUEUE_WAIT_HEADER: f"{wait:.3f}",
+                })
+                await response.prepare(request)
+                # Streamed replies are passed on chunk by chunk as Ollama produces them
+                async for chunk in upstream_response.content.iter_any():
+                    await response.write(chunk)
+                await response.write_eof()
+                return response
+        except aiohttp.ClientError as e:
+            return web.json_response({"error": f"gateway: Ollama unreachable ({e})"}, status=502,
+                                     headers={QUEUE_WAIT_HEADER: f"{wait:.3f}"})
+        finally:
+            if queued:
+                scheduler.release()
+
+    app.on_startup.append(open_session)
+    app.on_cleanup.append(close_session)
+    app.router.add_get("/gateway/status", status)
+    app.router.add_route("*", "/{path:.*}", proxy)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Priority gateway in front of Ollama.")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--upstream", default="http://127.0.0.1:11434")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="requests sent to Ollama at once (match OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--max-queue", type=int, default=32, help="requests allowed to wait before shedding (0 = shed whatever can't run at once)")
+    args = parser.parse_args()
+    print(f"🚦 Priority gateway on port {args.port} -> {args.upstream} "
+          f"(concurrency {args.concurrency}, queue {args.max_queue})")
+    # handler_cancellation: a client that hangs up while queued leaves the queue instead of using the GPU
+    web.run_app(make_app(args.upstream, args.concurrency, args.max_queue), port=args.port, print=None,
+                handler_cancellation=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,601 @@
+### ASYNC SOVEREIGN CLIENT
+# asyncio version of SovereignClient, for running many conversations at once
+# (several robots, a batch grading service...) on ONE event loop instead of a thread each.
+# Memory works exactly like SovereignClient: set_persona, clear_memory and forget_last are
+# inherited unchanged, while chat, chat_stream, compress_memory and health become coroutines (warm_up returns a task).
+# Failures raise the same SovereignErrors (timeouts, circuit breaker, hedge=True and cascade= work the same too).
+# Requires aiohttp:  pip install aiohttp
+#
+# Usage:
+#     async with aiohttp.ClientSession() as session:
+#         limiter = asyncio.Semaphore(8)   # at most 8 requests in flight to this endpoint
+#         bots = [AsyncSovereignClient(URL, session=session, limiter=limiter) for _ in range(200)]
+#         replies = await asyncio.gather(*(bot.chat("Hello") for bot in bots))
+
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+
+try:
+    import aiohttp
+except ImportError:  # Optional dependency: only needed for the async client
+    aiohttp = None
+
+from errors import SovereignError, ServerError, ServerBusy
+from endpoint_pool import has_model
+from sovereign_client import SovereignClient, CONNECT_TIMEOUT, NGROK_ERROR_HEADER, estimate_tokens
+from structured_output import IncrementalJSONParser
+from telemetry import TurnMetrics, queue_wait_from
+
+
+class AsyncSovereignClient(SovereignClient):
+    """
+    Non-blocking client for your Cloud AI.
+    Same memory management and personas as SovereignClient, but every network call is awaited.
+    """
+    def __init__(self, api_url, model="qwen2.5:14b", system_prompt="You are a helpful assistant.",
+                 max_concurrency=4, session=None, limiter=None, **kwargs):
+        """
+        :param max_concurrency: Max requests this client may have in flight at once.
+        :param session: Optional aiohttp.ClientSession. Share one across clients to share its connection pool.
+        :param limiter: Optional asyncio.Semaphore. Share one across clients to cap the load on one endpoint.
+        Other keyword arguments (context_tokens, auto_compress_tokens...) work as in SovereignClient.
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncSovereignClient needs aiohttp. Install it with: pip install aiohttp")
+        super().__init__(api_url, model=model, system_prompt=system_prompt, **kwargs)
+
+        # The aiohttp session is created lazily (it must be made inside a running event loop)
+        self.session = session
+        self._owns_session = session is None
+        self.max_concurrency = max_concurrency
+        self.limiter = limiter if limiter is not None else asyncio.Semaphore(max_concurrency)
+        self._compress_task = None
+        self._archive_task = None
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self.session = aiohttp.ClientSession(connector=connector)
+            self._owns_session = True
+        return self.session
+
+    async def close(self):
+        """Closes the HTTP session (only if this client created it)."""
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _network_error(self, e):
+        """The SovereignError for a failed connection (aiohttp exception)."""
+        connect_timeout = getattr(aiohttp, "ConnectionTimeoutError", ())  # aiohttp >= 3.10
+        if isinstance(e, asyncio.TimeoutError) and not isinstance(e, connect_timeout):
+            return self._timeout_error(e)
+        return super()._network_error(e)
+
+    @asynccontextmanager
+    async def _request(self, payload, stream=False, candidates=None, timeout=None, blame=True):
+        """
+        One request through the endpoint pool (within this client's concurrency limit),
+        failing over to the next endpoint when a server can't be reached or answers with a server error.
+        HTTP errors and failures while reading the body are raised as SovereignErrors.
+        timeout / blame: see SovereignClient._open.
+        """
+        self._check_circuit()
+        async with self.limiter:
+            candidates = candidates or self.endpoints.candidates()
+            read_timeout = timeout if timeout is not None else self._read_timeout(payload, stream)
+            client_timeout = aiohttp.ClientTimeout(total=None, connect=CONNECT_TIMEOUT, sock_read=read_timeout)
+            last_error = None
+            for i, endpoint in enumerate(candidates):
+                self.endpoints.begin(endpoint)
+                start = time.perf_counter()
+                try:
+                    response = await self._get_session().post(endpoint.chat_url, json=payload,
+                                                              headers=self.headers, timeout=client_timeout)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    self.endpoints.report(endpoint, ok=False if blame else None)
+                    last_error = e
+                    continue
+                except BaseException:
+                    self.endpoints.report(endpoint, ok=None) # cancelled (e.g. the losing copy of a hedge)
+                    raise
+                down = ((response.status >= 500 and not self._is_shed(response.status, response.headers))
+                        or NGROK_ERROR_HEADER in response.headers)
+                if down and i < len(candidates) - 1:
+                    response.release()
+                    self.endpoints.report(endpoint, ok=False if blame else None)
+                    continue
+                if timeout is None and response.status < 400:
+                    self._observe_latency(payload, stream, time.perf_counter() - start)
+
+                ok = False
+                try:
+                    async with response:
+                        if response.status >= 400:
+                            raise self._status_error(response.status, response.headers, await response.text())
+                        try:
+                            yield response
+                        except (GeneratorExit, asyncio.CancelledError):
+                            ok = None # the caller stopped reading early, or cancelled: no verdict
+                            raise
+                        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                                asyncio.TimeoutError) as e:
+                            raise self._network_error(e) from e
+                        except ValueError as e:
+                            raise ServerError(f"Malformed answer from the server: {e}") from e
+                    ok = True
+                    self._timeout_scale = 1
+                except ServerBusy:
+                    ok = None # shed by the priority gateway: no verdict on the server
+                    raise
+                except ServerError as e:
+                    ok = e.status is not None and e.status < 500
+                    raise
+                finally:
+                    self.endpoints.report(endpoint, ok if blame else None)
+                return
+            raise self._network_error(last_error) from last_error
+
+    async def _fetch(self, payload, candidates=None, timeout=None, blame=True):
+        """One non-streamed request. Returns (data, queue_wait)."""
+        async with self._request(payload, candidates=candidates, timeout=timeout, blame=blame) as response:
+            return await response.json(content_type=None), queue_wait_from(response.headers)
+
+    async def _post(self, payload):
+        """
+        One non-streamed request, hedged like SovereignClient._post.
+        Here the slower copy is cancelled (its connection closed) as soon as the other one answers.
+        """
+        delay = self._hedge_delay(payload)
+        if delay is None:
+            return await self._fetch(payload)
+        candidates = self.endpoints.candidates()
+        pending = {asyncio.ensure_future(self._fetch(payload, candidates))}
+        first = next(iter(pending))
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+
+            second = asyncio.ensure_future(self._fetch(payload, candidates[1:] + candidates[:1]))
+            self.telemetry.record_hedge()
+            pending.add(second)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.telemetry.record_hedge(won=True)
+                        return task.result()
+            return first.result() # both failed: raise the original request's error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _try_small_model(self, payload, rule):
+        """Cascade: the small model first, see SovereignClient._try_small_model."""
+        if rule is None:
+            return None
+        start = time.perf_counter()
+        try:
+            data, queue_wait = await self._post(self.cascade.small_payload(payload, rule))
+            reason = self.cascade.judge(rule, data, payload.get("format"))
+        except SovereignError:
+            reason = "small model failed"
+        self.cascade.record_small(time.perf_counter() - start, reason)
+        return (data, queue_wait) if reason is None else None
+
+    async def _post_large(self, payload):
+        """Cascade: _post to `model`, timed for the latency saved estimate."""
+        start = time.perf_counter()
+        answer = await self._post(payload)
+        if self.cascade is not None:
+            self.cascade.record_large(time.perf_counter() - start)
+        return answer
+
+    @staticmethod
+    async def _chunks(response):
+        """Ollama streams NDJSON, one JSON object per line (the last one has "done": true)."""
+        async for line in response.content:
+            line = line.strip()
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise ServerError(chunk["error"])
+            yield chunk
+
+    async def _stream_chunks(self, payload, prompt_tokens):
+        """
+        One turn's reply as (chunk, queue_wait) pairs, the small model streaming first with a cascade
+        (held back and judged, see SovereignClient._stream_chunks).
+        """
+        rule = self._cascade_rule(payload, prompt_tokens)
+        if rule is not None and payload.get("format") is not None:
+            answer = await self._try_small_model(payload, rule)
+            if answer is not None:
+                yield answer
+                return
+        elif rule is not None:
+            start = time.perf_counter()
+            kept = False
+            reason = "small model failed" # unless it is judged below
+            try:
+                small = self.cascade.small_payload(payload, rule, stream=True)
+                async with self._request(small, stream=True) as response:
+                    queue_wait = queue_wait_from(response.headers)
+                    held = ""
+                    async for chunk in self._chunks(response):
+                        if not kept:
+                            held += chunk.get("message", {}).get("content", "")
+                            done = chunk.get("done")
+                            if not done and len(held) < rule.hold_chars:
+                                continue
+                            chunk = dict(chunk, message={"role": "assistant", "content": held})
+                            reason = self.cascade.judge(rule, chunk, partial=not done)
+                            if reason is not None:
+                                break
+                            kept = True
+                        yield chunk, queue_wait
+                        if chunk.get("done"):
+                            break
+            except SovereignError:
+                if kept:
+                    raise # already shown: it fails like any streamed turn
+            self.cascade.record_small(time.perf_counter() - start, None if kept else reason)
+            if kept:
+                return
+
+        start = time.perf_counter()
+        async with self._request(payload, stream=True) as response:
+            queue_wait = queue_wait_from(response.headers)
+            async for chunk in self._chunks(response):
+                yield chunk, queue_wait
+                if chunk.get("done"):
+                    break
+        if self.cascade is not None:
+            self.cascade.record_large(time.perf_counter() - start)
+
+    async def _probe(self, endpoint, timeout):
+        """Health of one endpoint (two metadata requests, no generation)."""
+        result = {"url": endpoint.base_url, "reachable": False, "model_available": False,
+                  "model_loaded": False, "latency": None, "error": None}
+        try:
+            start = time.perf_counter()
+            for path, field in (("/api/tags", "model_available"), ("/api/ps", "model_loaded")):
+                async with self._get_session().get(endpoint.base_url + path, headers=self.headers,
+                                                   timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    if response.status >= 400:
+                        raise self._status_error(response.status, response.headers, await response.text())
+                    result[field] = has_model((await response.json(content_type=None)).get("models", []), self.model)
+                if result["latency"] is None:
+                    result["latency"] = time.perf_counter() - start
+                    result["reachable"] = True
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            result["error"] = str(self._network_error(e))
+        except (SovereignError, ValueError) as e:
+            result["error"] = str(e)
+        return result
+
+    async def health(self, timeout=5):
+        """Cheap readiness probe, see SovereignClient.health (all servers are asked at once)."""
+        endpoints = await asyncio.gather(*(self._probe(e, timeout) for e in self.endpoints.endpoints))
+        return {
+            "reachable": any(e["reachable"] for e in endpoints),
+            "ready": any(e["model_available"] for e in endpoints),
+            "loaded": any(e["model_loaded"] for e in endpoints),
+            "endpoints": list(endpoints),
+        }
+
+    def warm_up(self):
+        """
+        Preloads the model into VRAM on every server, as a task on this event loop (await it to wait).
+        The outcome ends up in last_warm_up, see SovereignClient.warm_up.
+        """
+        self.last_warm_up = None
+
+        async def load(endpoint):
+            try:
+                for payload in self._warm_up_payloads():
+                    await self._fetch(payload, candidates=[endpoint], timeout=self.max_timeout, blame=False)
+            except SovereignError as e:
+                return str(e)
+
+        async def run():
+            start = time.perf_counter()
+            errors = [e for e in await asyncio.gather(*(load(e) for e in self.endpoints.endpoints)) if e]
+            self.last_warm_up = {"seconds": time.perf_counter() - start, "error": errors[0] if errors else None}
+
+        return asyncio.ensure_future(run())
+
+    def _finish_turn(self, ai_msg):
+        """Stores the AI reply, then starts background compression as a task on this event loop."""
+        self._remember("assistant", ai_msg)
+        folded = self._claim_turns_to_fold()
+        if folded:
+            self._compress_task = asyncio.ensure_future(self._background_compress(*folded))
+        if self.memory is not None:
+            evicted = self.memory.claim_pending()
+            if evicted:
+                self._archive_task = asyncio.ensure_future(self._archive_evicted(*evicted))
+
+    async def _embed(self, texts):
+        """Embeddings of several texts in one request (Ollama /api/embed)."""
+        endpoint = self.endpoints.candidates()[0]
+        payload = {"model": self.memory.embed_model, "input": texts, "keep_alive": self.keep_alive}
+        timeout = aiohttp.ClientTimeout(total=60, connect=CONNECT_TIMEOUT)
+        async with self._get_session().post(endpoint.base_url + "/api/embed", json=payload,
+                                            headers=self.headers, timeout=timeout) as response:
+            response.raise_for_status()
+            return (await response.json(content_type=None))["embeddings"]
+
+    async def _recall(self, user_input):
+        """Message of old turns relevant to user_input, or None. Best effort: never fails a turn."""
+        if self.memory is None or len(self.memory) == 0 or self.endpoints.retry_in() > 0:
+            return None
+        try:
+            return self.memory.recall((await self._embed([user_input]))[0])
+        except Exception as e:
+            print(f"⚠️ Recall skipped: {e}")
+            return None
+
+    async def _archive_evicted(self, generation, snippets):
+        """Task: embeds turns that left the window (in batches) and adds them to the index."""
+        try:
+            for batch in self.memory.batches(snippets):
+                self.memory.store(generation, batch, await self._embed(batch))
+        except Exception as e:
+            print(f"❌ Archiving to long-term memory failed: {e}")
+        finally:
+            self.memory.done_archiving()
+
+    async def _background_compress(self, epoch, turns):
+        """Task: summarizes the folded turns while the conversation carries on."""
+        try:
+            payload = self._incremental_summary_payload(turns)
+            data, _ = await self._fetch(payload, timeout=self.max_timeout)
+            self._swap_in_summary(epoch, turns, data['message']['content'])
+        except Exception as e:
+            print(f"❌ Background Compression Failed: {e}")
+        finally:
+            self._compressing = False
+
+    async def chat(self, user_input, temperature=0.7, on_token=None, format=None, instruction=None):
+        """
+        Send message to server and get response.
+        :param temperature: 0.1 = Robotic/Precise, 0.9 = Creative/Random
+        :param on_token: Optional callback, called with every streamed chunk as it arrives.
+        :param format: Optional Ollama output format: "json" or a JSON schema dict.
+        :param instruction: Optional one-off instruction for this reply only (not stored), see SovereignClient.chat.
+        Raises a SovereignError if the turn failed (the user message is then not kept in memory).
+        """
+        if on_token is not None:
+            pieces = []
+            stream = self.chat_stream(user_input, temperature=temperature, format=format, instruction=instruction)
+            try:
+                async for token in stream:
+                    on_token(token)
+                    pieces.append(token)
+            finally:
+                await stream.aclose() # if on_token raised, the turn is rolled back right away
+            return "".join(pieces)
+
+        payload = self._prepare_turn(user_input, temperature, stream=False, format=format,
+                                     recalled=await self._recall(user_input), instruction=instruction)
+        start = time.perf_counter()
+
+        cache_key, cached = self._cache_lookup(payload, temperature)
+        if cached is not None:
+            total = time.perf_counter() - start
+            self.last_stats = {"ttft": total, "total": total}
+            self._finish_turn(cached)
+            return cached
+
+        try:
+            rule = self._cascade_rule(payload, self._history_tokens)
+            data, queue_wait = await self._try_small_model(payload, rule) or await self._post_large(payload)
+        except SovereignError:
+            self.telemetry.record_error()
+            self._rollback_turn(payload)
+            raise
+        except BaseException:
+            # Cancelled: the unanswered turn isn't kept either
+            self._rollback_turn(payload)
+            raise
+        ai_msg = data['message']['content']
+
+        total = time.perf_counter() - start
+        self.last_stats = {"ttft": total, "total": total}
+        self._record_metrics(data, ttft=None, queue_wait=queue_wait)
+
+        if cache_key is not None:
+            self.cache.put(cache_key, ai_msg)
+        self._finish_turn(ai_msg)
+        return ai_msg
+
+    async def chat_stream(self, user_input, temperature=0.7, format=None, instruction=None):
+        """
+        Async generator version of chat(). Yields text chunks as Ollama generates them.
+        Raises a SovereignError if the turn failed, even midway.
+
+        Usage:
+            async for token in bot.chat_stream("Hello"):
+                print(token, end="", flush=True)
+        """
+        payload = self._prepare_turn(user_input, temperature, stream=True, format=format,
+                                     recalled=await self._recall(user_input), instruction=instruction)
+        start = time.perf_counter()
+        self.last_stats = {"ttft": None, "total": None}
+        pieces = []
+        final = {}
+        queue_wait = None
+
+        cache_key, cached = self._cache_lookup(payload, temperature)
+        if cached is not None:
+            total = time.perf_counter() - start
+            self.last_stats = {"ttft": total, "total": total}
+            self._finish_turn(cached)
+            yield cached
+            return
+
+        # With a cascade the small model streams first (see _stream_chunks)
+        chunks = self._stream_chunks(payload, self._history_tokens)
+        try:
+            async for chunk, queue_wait in chunks:
+                token = chunk.get("message", {}).get("content", "")
+                if token:
+                    if self.last_stats["ttft"] is None:
+                        self.last_stats["ttft"] = time.perf_counter() - start
+                    pieces.append(token)
+                    yield token
+
+                if chunk.get("done"):
+                    final = chunk # the stream ends with it
+
+        except SovereignError:
+            self.telemetry.record_error()
+            self._rollback_turn(payload)
+            raise
+        except BaseException:
+            # Abandoned mid-reply (the caller stopped reading, cancelled...): the unanswered turn isn't kept either
+            self._rollback_turn(payload)
+            raise
+        finally:
+            await chunks.aclose()
+
+        self.last_stats["total"] = time.perf_counter() - start
+        self._record_metrics(final, ttft=self.last_stats["ttft"], queue_wait=queue_wait)
+        ai_msg = "".join(pieces)
+        if cache_key is not None:
+            self.cache.put(cache_key, ai_msg)
+        self._finish_turn(ai_msg)
+
+    async def chat_json(self, user_input, schema=None, temperature=0.1, on_field=None):
+        """
+        Structured output, see SovereignClient.chat_json.
+        Returns the parsed object, or None if the reply was malformed. Raises a SovereignError if the request failed.
+        """
+        format = schema if schema is not None else "json"
+        if on_field is None:
+            text = await self.chat(user_input, temperature=temperature, format=format)
+        else:
+            parser = IncrementalJSONParser()
+            pieces = []
+            async for token in self.chat_stream(user_input, temperature=temperature, format=format):
+                pieces.append(token)
+                for key, value in parser.feed(token):
+                    on_field(key, value)
+            text = "".join(pieces)
+        return self._parse_json_reply(text, schema)
+
+    async def _complete(self, messages, temperature, format=None):
+        """One stateless request (memory is not touched). Raises a SovereignError on failure."""
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": False,
+            "options": {"temperature": temperature, "num_ctx": self.context_tokens},
+            "keep_alive": self.keep_alive
+        }
+        if format is not None:
+            payload["format"] = format
+        cache_key, cached = self._cache_lookup(payload, temperature)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        rule = self._cascade_rule(payload, sum(estimate_tokens(m["content"]) for m in messages))
+        data, queue_wait = await self._try_small_model(payload, rule) or await self._post_large(payload)
+        self.telemetry.record(TurnMetrics(time.perf_counter() - start, data=data, model=self.model,
+                                          queue_wait=queue_wait))
+        ai_msg = data['message']['content']
+        if cache_key is not None:
+            self.cache.put(cache_key, ai_msg)
+        return ai_msg
+
+    async def _run_batch_item(self, item_id, item, temperature, retries, format):
+        """Runs one batch item with retries (1s, 2s, 4s... backoff)."""
+        messages = self._batch_messages(item)
+        if isinstance(item, dict):
+            temperature = item.get("temperature", temperature)
+        error = None
+        for attempt in range(1, retries + 2):
+            try:
+                reply = await self._complete(messages, temperature, format=format)
+                return {"id": item_id, "reply": reply, "error": None, "attempts": attempt}
+            except Exception as e:
+                self.telemetry.record_error()
+                error = str(e)
+                if attempt <= retries:
+                    await asyncio.sleep(2 ** (attempt - 1))
+        return {"id": item_id, "reply": None, "error": error, "attempts": retries + 1}
+
+    async def chat_many(self, items, concurrency=None, temperature=0.7, retries=2, checkpoint=None, format=None):
+        """
+        BATCH MODE, see SovereignClient.chat_many. An async generator:
+            async for result in bot.chat_many(questions, checkpoint="grading.jsonl"):
+                print(result["id"], result["reply"])
+        :param concurrency: Tasks kept running (default: max_concurrency). Requests are also capped by the limiter.
+        """
+        concurrency = concurrency or self.max_concurrency
+        done_ids = self._load_checkpoint(checkpoint)
+        log = open(checkpoint, "a") if checkpoint is not None else None
+        source = iter(enumerate(items))
+        pending = set()
+
+        def submit_next():
+            for index, item in source:
+                item_id = item.get("id", index) if isinstance(item, dict) else index
+                if item_id in done_ids:
+                    continue
+                pending.add(asyncio.ensure_future(
+                    self._run_batch_item(item_id, item, temperature, retries, format)))
+                return True
+            return False
+
+        try:
+            for _ in range(concurrency):
+                if not submit_next():
+                    break
+            while pending:
+                finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    pending.remove(task)
+                    result = task.result()
+                    if log is not None:
+                        log.write(json.dumps(result) + "\n")
+                        log.flush()
+                    submit_next()
+                    yield result
+        finally:
+            for task in pending:
+                task.cancel()
+            if log is not None:
+                log.close()
+
+    async def compress_memory(self):
+        """
+        ADVANCED: Asks the AI to summarize the chat so far,
+        then wipes history and replaces it with the summary.
+        """
+        print("🗜️ Compressing Memory...", end="\r")
+        payload = self._summary_payload()
+
+        try:
+            async with self._request(payload, timeout=self.max_timeout) as response:
+                data = await response.json(content_type=None)
+            summary_text = data['message']['content']
+
+            self._apply_summary(summary_text)
+            print("✅ Memory Compressed. Space Reclaimed.")
+            return summary_text
+
+        except Exception as e:
+            print(f"❌ Compression Failed: {e}")
@@ -0,0 +1,421 @@
+### CLIENT BENCHMARK SUITE
+# Measures SovereignClient against the local MockOllamaServer,
+# so no Colab GPU or ngrok tunnel is needed.
+# Scenarios:
+#   sync        --> one conversation, plain chat() calls
+#   streaming   --> one conversation, chat_stream() (time to first token + total)
+#   concurrent  --> many conversations at once, one thread each
+#   pooling     --> new connection per turn vs the pooled keep-alive session
+#   memory      --> client memory growth over a long conversation
+#   prefix      --> prompt tokens the server must re-read per turn (prefix cache reuse) once the window is full
+#   recall      --> bytes sent per turn with a big window vs a small window + retrieval memory, and whether an early fact is recalled
+#   resume      --> time to reopen a huge stored conversation (SQLiteStore) and how much of it ends up in RAM
+# Reports p50/p95/p99 latency, throughput, bytes on the wire per turn and memory growth.
+# Results are saved as JSON so runs on different commits can be compared.
+#
+# Run it using:
+#     python3 ./Sovereign_AI/benchmark.py --out bench.json
+#     python3 ./Sovereign_AI/benchmark.py --out new.json --compare bench.json
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import requests
+
+from conversation_store import SQLiteStore
+from errors import SovereignError
+from mock_ollama import MockOllamaServer
+from retrieval_memory import RetrievalMemory
+from sovereign_client import SovereignClient, estimate_tokens
+
+
+# ==============================================================================
+#                                   HELPERS
+# ==============================================================================
+def percentiles(samples):
+    """Latency summary in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+    }
+
+
+def _client(server, **options):
+    """
+    A client for the benchmark, with the circuit breaker off: with injected failures the breaker would
+    open and the following turns would fail in ~0 ms, which measures the breaker instead of the client.
+    """
+    return SovereignClient(server.url, breaker_threshold=float("inf"), **options)
+
+
+def _failed(call, *args):
+    """Runs one turn. Returns 1 if it failed (injected failures...), else 0. Failed turns are left out of the latencies."""
+    try:
+        call(*args)
+        return 0
+    except SovereignError:
+        return 1
+
+
+def _until_ok(call, *args, attempts=10):
+    """Runs a turn the scenario can't do without, retrying injected failures."""
+    for _ in range(attempts - 1):
+        if not _failed(call, *args):
+            return
+    call(*args)
+
+
+def _wire_bytes(server, turns):
+    """Average request + response bytes per turn (as seen by the server)."""
+    return (server.bytes_in + server.bytes_out) / turns if turns else 0
+
+
+# ==============================================================================
+#                                  SCENARIOS
+# ==============================================================================
+def bench_sync(server, turns):
+    """One conversation, blocking chat() calls back to back."""
+    server.reset_counters()
+    bot = _client(server)
+    timings, errors = [], 0
+    started = time.perf_counter()
+    for i in range(turns):
+        start = time.perf_counter()
+        if _failed(bot.chat, f"Turn {i}"):
+            errors += 1
+        else:
+            timings.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    return {
+        "latency": percentiles(timings),
+        "turns_per_s": turns / elapsed,
+        "bytes_per_turn": _wire_bytes(server, turns),
+        "errors": errors,
+    }
+
+
+def bench_streaming(server, turns):
+    """One conversation, streamed with chat_stream()."""
+    server.reset_counters()
+    bot = _client(server)
+    ttft, totals, errors = [], [], 0
+    for i in range(turns):
+        if _failed(lambda: "".join(bot.chat_stream(f"Turn {i}"))):
+            errors += 1
+            continue
+        if bot.last_stats["ttft"] is not None:
+            ttft.append(bot.last_stats["ttft"])
+        if bot.last_stats["total"] is not None:
+            totals.append(bot.last_stats["total"])
+    return {
+        "ttft": percentiles(ttft),
+        "latency": percentiles(totals),
+        "bytes_per_turn": _wire_bytes(server, turns),
+        "errors": errors,
+    }
+
+
+def bench_concurrent(server, clients, turns):
+    """`clients` independent conversations at once, one thread each, `turns` turns per conversation."""
+    server.reset_counters()
+    timings, errors = [], []
+    lock = threading.Lock()
+
+    def conversation(n):
+        bot = _client(server, pool_size=clients)
+        local, failed = [], 0
+        for i in range(turns):
+            start = time.perf_counter()
+            if _failed(bot.chat, f"Conversation {n}, turn {i}"):
+                failed += 1
+            else:
+                local.append(time.perf_counter() - start)
+        with lock:
+            timings.extend(local)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=conversation, args=(n,)) for n in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "clients": clients,
+        "latency": percentiles(timings),
+        "turns_per_s": clients * turns / elapsed,
+        "bytes_per_turn": _wire_bytes(server, clients * turns),
+        "errors": sum(errors),
+    }
+
+
+def bench_connection_pooling(server, turns):
+    """
+    Per-turn overhead with and without the pooled keep-alive session.
+    'new_connection' passes the requests module itself as the session, so every turn opens
+    (and closes) a brand new connection, exactly like a module-level requests.post.
+    """
+    results = {}
+    for name, session in (("new_connection", requests), ("pooled", None)):
+        bot = _client(server, session=session)
+        timings = []
+        for i in range(turns):
+            start = time.perf_counter()
+            if not _failed(bot.chat, f"Turn {i}"):
+                timings.append(time.perf_counter() - start)
+        results[name] = percentiles(timings)
+    return results
+
+
+def bench_memory_growth(server, turns, checkpoints=5):
+    """Traced Python memory of one long conversation, sampled at a few checkpoints."""
+    tracemalloc.start()
+    try:
+        bot = _client(server)
+        baseline = tracemalloc.get_traced_memory()[0]
+        samples = []
+        every = max(1, turns // checkpoints)
+        for i in range(1, turns + 1):
+            _failed(bot.chat, f"Turn {i}: " + "some longer user text " * 10)
+            if i % every == 0:
+                samples.append({"turn": i, "bytes": tracemalloc.get_traced_memory()[0] - baseline,
+                                "history_messages": len(bot.history)})
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    growth = (samples[-1]["bytes"] - samples[0]["bytes"]) / (samples[-1]["turn"] - samples[0]["turn"]) \
+        if len(samples) > 1 else 0
+    return {"samples": samples, "peak_bytes": peak, "bytes_per_turn_after_first_checkpoint": growth}
+
+
+def bench_prefix_stability(server, turns, context_tokens=1024):
+    """
+    Average prompt_eval_count per turn once the sliding window is full.
+    'trim_every_turn' (trim_target=1.0) drops a little history on every turn, which changes the
+    prompt right after the system prompt; 'trim_in_chunks' (the default) keeps the prefix stable.
+    """
+    results = {}
+    for name, trim_target in (("trim_every_turn", 1.0), ("trim_in_chunks", None)):
+        options = {"context_tokens": context_tokens, "reply_tokens": 128}
+        if trim_target is not None:
+            options["trim_target"] = trim_target
+        bot = _client(server, **options)
+        counts = []
+        for i in range(turns):
+            if _failed(bot.chat, f"Turn {i}: " + "a message of moderate length " * 4):
+                continue # last_metrics is still the previous turn's
+            if bot.last_metrics is not None and bot.last_metrics.prompt_eval_count is not None:
+                counts.append(bot.last_metrics.prompt_eval_count)
+        steady = counts[len(counts) // 2:]  # second half: window is full
+        results[name] = {
+            "prompt_eval_count_mean": statistics.mean(steady) if steady else 0,
+            "prompt_eval_count_p95": sorted(steady)[int(0.95 * len(steady))] if steady else 0,
+        }
+    return results
+
+
+def bench_recall(server, turns):
+    """
+    A long session where the first turn holds a fact asked about at the end.
+    'big_window' keeps ~4k tokens of history; 'small_window_recall' keeps ~1k and relies on retrieval memory.
+    """
+    fact = "My lab partner is called Marguerite and our robot is named Bolt"
+    question = "What is my lab partner called and what is our robot named?"
+    results = {}
+    for name, context_tokens, memory in (("big_window", 4096, None),
+                                         ("small_window_recall", 1024, RetrievalMemory(k=2, budget_tokens=256, min_score=0.2))):
+        bot = _client(server, context_tokens=context_tokens, reply_tokens=256, memory=memory)
+        _until_ok(bot.chat, fact)
+        server.reset_counters()
+        for i in range(turns):
+            _failed(bot.chat, f"Turn {i}: explain another detail of op-amp feedback and slew rate")
+            if memory is not None:
+                time.sleep(0.001)  # let the archiving worker keep up, as it would between human turns
+        sent = server.bytes_in / turns
+        recalled = bot._recall(question) if memory is not None else None
+        in_window = any(fact in m["content"] for m in bot.history)
+        results[name] = {
+            "bytes_sent_per_turn": sent,
+            "fact_available": in_window or (recalled is not None and fact in recalled["content"]),
+        }
+    return results
+
+
+def bench_resume(server, archive_turns):
+    """
+    Writes an archive of `archive_turns` messages to a SQLiteStore, then times how long a fresh
+    client takes to resume it and how many messages it loads into memory.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "sessions.db")
+        store = SQLiteStore(path)
+        store.reset("archive", "You are a helpful assistant.")
+        started = time.perf_counter()
+        for i in range(archive_turns):
+            role = "user" if i % 2 == 0 else "assistant"
+            content = f"Message {i}: " + "archived conversation text " * 8
+            store.append("archive", role, content, estimate_tokens(content))
+        append_s = (time.perf_counter() - started) / archive_turns if archive_turns else 0
+        store.close()
+
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            store = SQLiteStore(path)
+            bot = SovereignClient(server.url, store=store, session_id="archive")
+            timings.append(time.perf_counter() - start)
+            store.close()
+        size = os.path.getsize(path)
+    return {
+        "archive_messages": archive_turns,
+        "append_us": append_s * 1e6,
+        "resume": percentiles(timings),
+        "messages_in_memory": len(bot.history),
+        "file_bytes": size,
+    }
+
+
+# ==============================================================================
+#                                   SUITE
+# ==============================================================================
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    server_settings = {
+        "latency": args.latency,
+        "tokens_per_second": args.tps,
+        "chunk_tokens": args.chunk_tokens,
+        "failure_rate": args.failure_rate,
+        "failure_mode": args.failure_mode,
+    }
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "server": server_settings,
+            "turns": args.turns,
+            "clients": args.clients,
+            "archive_turns": args.archive_turns,
+        }
+    }
+    with MockOllamaServer(**server_settings) as server:
+        print("⏱️  sync...");       results["sync"] = bench_sync(server, args.turns)
+        print("⏱️  streaming...");  results["streaming"] = bench_streaming(server, args.turns)
+        print("⏱️  concurrent..."); results["concurrent"] = bench_concurrent(server, args.clients, args.turns)
+        print("⏱️  pooling...");    results["pooling"] = bench_connection_pooling(server, args.turns)
+        print("⏱️  memory...");     results["memory"] = bench_memory_growth(server, args.memory_turns)
+        print("⏱️  prefix...");     results["prefix"] = bench_prefix_stability(server, args.turns)
+        print("⏱️  recall...");     results["recall"] = bench_recall(server, args.turns)
+        print("⏱️  resume...");     results["resume"] = bench_resume(server, args.archive_turns)
+    return results
+
+
+def _flatten(obj, prefix=""):
+    """{'sync': {'latency': {'p50_ms': 1}}} -> {'sync.latency.p50_ms': 1} (numbers only)."""
+    flat = {}
+    for key, value in obj.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(old, new):
+    """Prints every metric that exists in both runs with its relative change."""
+    before, after = _flatten({k: v for k, v in old.items() if k != "meta"}), \
+        _flatten({k: v for k, v in new.items() if k != "meta"})
+    print(f"\n📊 {old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    for name in sorted(before.keys() & after.keys()):
+        a, b = before[name], after[name]
+        change = f"{(b - a) / a:+.1%}" if a else "n/a"
+        print(f"   {name:<45} {a:>12.2f} -> {b:>12.2f}  ({change})")
+
+
+def print_summary(results):
+    for name in ("sync", "streaming", "concurrent"):
+        r = results[name]
+        line = f"   {name:<11} p50 {r['latency']['p50_ms']:.2f} ms  p95 {r['latency']['p95_ms']:.2f} ms  " \
+               f"p99 {r['latency']['p99_ms']:.2f} ms  {r['bytes_per_turn']:.0f} B/turn  errors {r['errors']}"
+        if "turns_per_s" in r:
+            line += f"  {r['turns_per_s']:.1f} turns/s"
+        print(line)
+    print(f"   streaming   ttft p50 {results['streaming']['ttft'].get('p50_ms', 0):.2f} ms")
+    pooling = results["pooling"]
+    print(f"   pooling     new connection p50 {pooling['new_connection']['p50_ms']:.2f} ms  "
+          f"-> pooled p50 {pooling['pooled']['p50_ms']:.2f} ms")
+    prefix = results["prefix"]
+    print(f"   prefix      prompt tokens re-read per turn: every-turn trim "
+          f"{prefix['trim_every_turn']['prompt_eval_count_mean']:.0f} -> chunked trim "
+          f"{prefix['trim_in_chunks']['prompt_eval_count_mean']:.0f}")
+    recall = results["recall"]
+    print(f"   recall      bytes sent per turn: big window {recall['big_window']['bytes_sent_per_turn']:.0f} "
+          f"(fact kept: {recall['big_window']['fact_available']}) -> small window + retrieval "
+          f"{recall['small_window_recall']['bytes_sent_per_turn']:.0f} "
+          f"(fact kept: {recall['small_window_recall']['fact_available']})")
+    resume = results["resume"]
+    print(f"   resume      {resume['archive_messages']} stored messages reopened in "
+          f"{resume['resume']['p50_ms']:.2f} ms, {resume['messages_in_memory']} kept in memory "
+          f"({resume['append_us']:.0f} us per append, {resume['file_bytes'] / 1e6:.1f} MB on disk)")
+    memory = results["memory"]
+    print(f"   memory      peak {memory['peak_bytes'] / 1024:.0f} KiB, "
+          f"{memory['bytes_per_turn_after_first_checkpoint']:.0f} B/turn growth")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SovereignClient against a local mock Ollama server.")
+    parser.add_argument("--turns", type=int, default=200, help="turns per scenario")
+    parser.add_argument("--clients", type=int, default=8, help="conversations in the concurrent scenario")
+    parser.add_argument("--memory-turns", type=int, default=1000, help="turns in the memory growth scenario")
+    parser.add_argument("--archive-turns", type=int, default=100000, help="stored messages in the resume scenario")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock server seconds before first token")
+    parser.add_argument("--tps", type=float, default=None, help="mock server tokens per second")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="tokens per streamed chunk")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--failure-mode", choices=["error", "disconnect"], default="error")
+    parser.add_argument("--out", help="save results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    print("\n🏁 Results")
+    print_summary(results)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Saved to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+### CONVERSATION STORE
+# Keeps conversations on disk so they survive restarts of study_app.py or the ROS node.
+# Every turn is written as it happens; on resume only the active window is read back
+# (newest messages first, until the token budget is full), so reopening a huge archive is instant
+# and RAM only ever holds the window. Older turns stay archived on disk.
+# we have ConversationStore --> the interface, implement it for other backends
+# we have SQLiteStore --> the default backend (one file, many sessions addressed by ID)
+#
+# Usage:
+#     store = SQLiteStore("sessions.db")
+#     bot = SovereignClient(URL, store=store, session_id="exam-calculus")   # resumes if it exists
+#     print(store.sessions())
+
+import sqlite3
+import threading
+import time
+import zlib
+
+# Messages longer than this are zlib-compressed on disk
+COMPRESS_OVER_BYTES = 512
+
+
+class ConversationStore:
+    """
+    Interface of a conversation store. Every method takes the session ID first.
+    A session has a system prompt, an optional summary, and messages; the "active" messages
+    are the ones after the last persona change / memory wipe / summary.
+    """
+    def load(self, session_id, max_tokens):
+        """
+        Returns {"system_prompt", "summary", "messages": [{"role", "content", "tokens"}, ...]} with the
+        newest active messages that fit in max_tokens (oldest first), or None if the session doesn't exist.
+        """
+        raise NotImplementedError
+
+    def append(self, session_id, role, content, tokens):
+        """Adds one message to the end of the session."""
+        raise NotImplementedError
+
+    def pop(self, session_id, count=1):
+        """Removes the newest `count` messages."""
+        raise NotImplementedError
+
+    def reset(self, session_id, system_prompt):
+        """Starts fresh (new persona or wiped memory). Older messages stay archived but inactive."""
+        raise NotImplementedError
+
+    def set_summary(self, session_id, summary, keep):
+        """Stores a new summary that replaces all active messages except the newest `keep`."""
+        raise NotImplementedError
+
+    def sessions(self):
+        """All sessions as [{"id", "updated", "messages"}], most recent first."""
+        raise NotImplementedError
+
+
+class SQLiteStore(ConversationStore):
+    """
+    Conversation store in a single SQLite file.
+    Messages are keyed on (session, seq), so reading a session's tail is an index range scan
+    no matter how long the archive is.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._next_seq = {}  # session -> seq of the next message (cached, saves a MAX() per append)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")    # appends don't rewrite the file
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id TEXT PRIMARY KEY, system_prompt TEXT, summary TEXT,"
+                " active_from INTEGER NOT NULL DEFAULT 0, updated REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " session TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL,"
+                " content, tokens INTEGER NOT NULL,"
+                " PRIMARY KEY (session, seq)) WITHOUT ROWID"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def _pack(content):
+        data = content.encode()
+        if len(data) > COMPRESS_OVER_BYTES:
+            return zlib.compress(data)  # stored as BLOB
+        return content                  # stored as TEXT
+
+    @staticmethod
+    def _unpack(value):
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode()
+        return value
+
+    def _seq(self, session_id):
+        if session_id not in self._next_seq:
+            row = self._db.execute("SELECT MAX(seq) FROM messages WHERE session = ?", (session_id,)).fetchone()
+            self._next_seq[session_id] = 0 if row[0] is None else row[0] + 1
+        return self._next_seq[session_id]
+
+    def load(self, session_id, max_tokens):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT system_prompt, summary, active_from FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            system_prompt, summary, active_from = row
+
+            # Newest first, stop once the budget is full: only the window is ever read
+            messages, used = [], 0
+            cursor = self._db.execute(
+                "SELECT role, content, tokens FROM messages WHERE session = ? AND seq >= ? ORDER BY seq DESC",
+                (session_id, active_from)
+            )
+            for role, content, tokens in cursor:
+                if used + tokens > max_tokens and messages:
+                    break
+                messages.append({"role": role, "content": self._unpack(content), "tokens": tokens})
+                used += tokens
+            cursor.close()
+
+        messages.reverse()
+        # The window should start with a user message, like the client's own trimming
+        while len(messages) > 1 and messages[0]["role"] != "user":
+            messages.pop(0)
+        return {"system_prompt": system_prompt, "summary": summary, "messages": messages}
+
+    def append(self, session_id, role, content, tokens):
+        with self._lock:
+            seq = self._seq(session_id)
+            self._db.execute("INSERT INTO messages VALUES (?, ?, ?, ?, ?)",
+                             (session_id, seq, role, self._pack(content), tokens))
+            self._db.execute("UPDATE sessions SET updated = ? WHERE id = ?", (time.time(), session_id))
+            self._db.commit()
+            self._next_seq[session_id] = seq + 1
+
+    def pop(self, session_id, count=1):
+        with self._lock:
+            seq = self._seq(session_id)
+            active_from = self._db.execute(
+                "SELECT active_from FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()[0]
+            first = max(active_from, seq - count)
+            self._db.execute("DELETE FROM messages WHERE session = ? AND seq >= ?", (session_id, first))
+            self._db.commit()
+            self._next_seq[session_id] = first
+
+    def reset(self, session_id, system_prompt):
+        with self._lock:
+            seq = self._seq(session_id)
+            self._db.execute(
+                "INSERT INTO sessions (id, system_prompt, summary, active_from, updated) VALUES (?, ?, NULL, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET system_prompt = excluded.system_prompt, summary = NULL, "
+                "active_from = excluded.active_from, updated = excluded.updated",
+                (session_id, system_prompt, seq, time.time())
+            )
+            self._db.commit()
+
+    def set_summary(self, session_id, summary, keep):
+        with self._lock:
+            seq = self._seq(session_id)
+            active_from = seq
+            if keep > 0:
+                row = self._db.execute(
+                    "SELECT seq FROM messages WHERE session = ? ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                    (session_id, keep - 1)
+                ).fetchone()
+                if row is not None:
+                    active_from = row[0]
+            self._db.execute("UPDATE sessions SET summary = ?, active_from = ?, updated = ? WHERE id = ?",
+                             (summary, active_from, time.time(), session_id))
+            self._db.commit()
+
+    def sessions(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT s.id, s.updated, (SELECT COUNT(*) FROM messages m WHERE m.session = s.id) "
+                "FROM sessions s ORDER BY s.updated DESC"
+            ).fetchall()
+        return [{"id": r[0], "updated": r[1], "messages": r[2]} for r in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
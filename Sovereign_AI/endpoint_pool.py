@@ -0,0 +1,180 @@
+### ENDPOINT POOL
+# Lets one client spread its turns over several Ollama servers (e.g. two Colab sessions),
+# so one dying or slowing down doesn't take everything with it.
+# The conversation lives in the client and is sent with every request,
+# so any server can answer any turn: history follows the client automatically.
+# we have candidates --> the endpoints to try, best first: fewest requests in flight ("least_outstanding")
+#                        or fastest to answer a health check ("lowest_latency")
+# we have begin / report --> count a request in flight, then feed back success/failure;
+#                            endpoints failing in a row are ejected for a cooldown
+# we have retry_in --> circuit breaker: how long until any endpoint may be tried again (0 = now)
+# we have check_health --> pings /api/tags on every endpoint (also run by a background thread)
+#
+# Usage:
+#     bot = SovereignClient(["https://colab-one.ngrok-free.dev", "https://colab-two.ngrok-free.dev"])
+#     print(bot.endpoints.status())
+
+import threading
+import time
+
+
+def has_model(models, model):
+    """Is `model` in an Ollama model list (/api/tags or /api/ps)? A name without a tag means ":latest"."""
+    wanted = model if ":" in model else model + ":latest"
+    return any(wanted in (m.get("name"), m.get("model")) for m in models)
+
+
+class Endpoint:
+    """One Ollama server and what we know about its health."""
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.chat_url = self.base_url + "/api/chat"
+        self.outstanding = 0        # requests in flight right now
+        self.latency = None         # smoothed health-check round trip (seconds)
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0    # time.monotonic() when it may be tried again
+        self.has_model = True       # last health check found our model on it
+
+    @property
+    def healthy(self):
+        return self.has_model and time.monotonic() >= self.ejected_until
+
+    def as_dict(self):
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class EndpointPool:
+    """
+    Routing, health checking and failover over several Ollama servers.
+    :param urls: Base URLs of the servers.
+    :param strategy: "least_outstanding" or "lowest_latency".
+    :param failure_threshold: Failures in a row before an endpoint is ejected.
+    :param cooldown: Seconds an ejected endpoint sits out before it is tried again.
+    :param health_interval: Seconds between background health checks (None = no background thread).
+    """
+    def __init__(self, urls, strategy="least_outstanding", failure_threshold=2, cooldown=30.0,
+                 health_interval=15.0, session=None, headers=None, model=None):
+        if isinstance(urls, str):
+            urls = [urls]
+        if not urls:
+            raise ValueError("EndpointPool needs at least one URL")
+        if strategy not in ("least_outstanding", "lowest_latency"):
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.health_interval = health_interval
+        self.session = session
+        self.headers = headers or {}
+        self.model = model
+        self._lock = threading.Lock()
+        self._health_thread = None
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def _sort_key(self, endpoint):
+        latency = endpoint.latency if endpoint.latency is not None else float("inf")
+        if self.strategy == "lowest_latency":
+            return (latency, endpoint.outstanding)
+        return (endpoint.outstanding, latency)
+
+    def candidates(self):
+        """
+        Endpoints to try, best first. Ejected ones come last (soonest back first).
+        (When every endpoint is ejected the client doesn't ask at all, see retry_in.)
+        """
+        self._ensure_health_thread()
+        with self._lock:
+            healthy = sorted((e for e in self.endpoints if e.healthy), key=self._sort_key)
+            ejected = sorted((e for e in self.endpoints if not e.healthy), key=lambda e: e.ejected_until)
+        return healthy + ejected
+
+    def retry_in(self):
+        """
+        Circuit breaker: 0 if an endpoint may be tried now, else the seconds until the first ejected one
+        gets another chance (it is then ejected again right away if that one request fails too).
+        """
+        now = time.monotonic()
+        with self._lock:
+            return max(0.0, min(e.ejected_until for e in self.endpoints) - now)
+
+    def begin(self, endpoint):
+        """Counts a request in flight on endpoint until report()."""
+        with self._lock:
+            endpoint.outstanding += 1
+
+    def report(self, endpoint, ok):
+        """
+        Ends a request started with begin(). ok=False counts towards ejection,
+        ok=None gives no verdict (the request was cancelled or abandoned by the caller).
+        """
+        with self._lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            if ok is not None:
+                self._record(endpoint, ok)
+
+    def _record(self, endpoint, ok):
+        if ok:
+            endpoint.consecutive_failures = 0
+            endpoint.ejected_until = 0.0
+            return
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.failure_threshold:
+            endpoint.ejected_until = time.monotonic() + self.cooldown
+
+    # ==========================================================================
+    #                               HEALTH CHECKS
+    # ==========================================================================
+    def check_health(self, timeout=5):
+        """
+        Pings /api/tags on every endpoint: updates latency and model presence, and ejects unreachable ones.
+        (Only real chat successes clear an endpoint's failure count: reachable isn't the same as working.)
+        """
+        if self.session is None:
+            return
+        for endpoint in self.endpoints:
+            start = time.perf_counter()
+            try:
+                response = self.session.get(endpoint.base_url + "/api/tags", headers=self.headers, timeout=timeout)
+                response.raise_for_status()
+                rtt = time.perf_counter() - start
+                models = response.json().get("models", [])
+                with self._lock:
+                    endpoint.latency = rtt if endpoint.latency is None else 0.7 * endpoint.latency + 0.3 * rtt
+                    endpoint.has_model = self.model is None or has_model(models, self.model)
+            except Exception:
+                with self._lock:
+                    # A failed health check ejects right away
+                    endpoint.consecutive_failures = max(endpoint.consecutive_failures + 1, self.failure_threshold)
+                    endpoint.ejected_until = time.monotonic() + self.cooldown
+
+    def _ensure_health_thread(self):
+        if self._health_thread is not None or not self.health_interval or len(self.endpoints) < 2:
+            return
+        with self._lock:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self):
+        while not self._stop.is_set():
+            self.check_health()
+            self._stop.wait(self.health_interval)
+
+    def close(self):
+        """Stops the background health checks."""
+        self._stop.set()
+
+    def status(self):
+        with self._lock:
+            return [endpoint.as_dict() for endpoint in self.endpoints]
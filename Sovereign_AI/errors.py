@@ -0,0 +1,57 @@
+### ERRORS
+# What SovereignClient raises when a turn fails (instead of returning an error text as the reply).
+# A failed turn is rolled back: the user message is not left in memory, so it can simply be sent again.
+# we have SovereignError --> base class, catch this to handle every failure
+# we have ServerUnreachable --> no connection to the server (tunnel down, wrong URL, connection dropped)
+# we have RequestTimeout --> the server took longer than the (adaptive) timeout
+# we have ServerError --> the server answered, but with an error (HTTP status, or an error from Ollama)
+# we have ServerBusy --> the priority gateway shed the request (503 + Retry-After): the server is fine, retry later
+# we have CircuitOpen --> failed fast: every server failed recently, nothing was sent
+#
+# Usage:
+#     try:
+#         reply = bot.chat("Hello")
+#     except SovereignError as e:
+#         print(f"❌ {e}")
+
+
+class SovereignError(Exception):
+    """A turn failed. The conversation is as it was before the turn."""
+
+
+class ServerUnreachable(SovereignError):
+    """The server could not be reached (or the connection dropped mid-reply)."""
+
+
+class RequestTimeout(SovereignError):
+    """The server took longer than the timeout."""
+
+
+class ServerError(SovereignError):
+    """
+    The server answered with an error.
+    :param status: HTTP status code (None for an error reported inside a streamed reply).
+    """
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class ServerBusy(ServerError):
+    """
+    The priority gateway turned the request away because its queue was full (not a server fault).
+    :param retry_after: Seconds the gateway asked to wait before trying again (None if not given).
+    """
+    def __init__(self, message, status=503, retry_after=None):
+        super().__init__(message, status=status)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(ServerUnreachable):
+    """
+    Every server failed recently, so the request was not even sent.
+    :param retry_in: Seconds until a server is tried again.
+    """
+    def __init__(self, message, retry_in):
+        super().__init__(message)
+        self.retry_in = retry_in
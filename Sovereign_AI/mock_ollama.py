@@ -0,0 +1,298 @@
+### MOCK OLLAMA SERVER
+# A tiny local stand-in for the Colab-hosted Ollama server.
+# It answers /api/chat like Ollama does (plain JSON or streamed NDJSON, with Ollama's timing fields)
+# and /api/tags, so the client can be benchmarked without a GPU or an ngrok tunnel.
+# It speaks HTTP/1.1 keep-alive, just like the real server behind ngrok.
+# Knobs:
+#   latency           --> seconds before the first token (queueing + prompt evaluation)
+#   tokens_per_second --> generation speed (None = instant)
+#   chunk_tokens      --> how many tokens go in each streamed NDJSON chunk
+#   failure_rate      --> share of requests that fail (failure_mode "error" = HTTP 500, "disconnect" = dropped connection)
+#   prompt_tokens_per_second --> prompt reading speed (None = instant)
+#   load_seconds      --> time to load a model into "VRAM" (with loaded=False the server starts cold)
+#   replies / latencies --> per-model overrides of reply / latency (e.g. a fast small model for a cascade)
+#   Like Ollama, options.num_predict cuts the reply off (done_reason "length" instead of "stop").
+#   Like Ollama, a chat request without messages only loads the model (done_reason "load"),
+#   and /api/ps lists the loaded models.
+#   Like Ollama, the part of the prompt shared with the previous request is cached and not re-read
+#   (prompt_eval_count only counts the new part).
+# /api/embed returns bag-of-words vectors (hashed words), so texts sharing words come out similar.
+#
+# Usage:
+#     with MockOllamaServer(latency=0.05, tokens_per_second=40) as server:
+#         bot = SovereignClient(server.url)
+#         bot.chat("Hello")
+
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Same rough estimate the client uses (~4 characters per token)
+CHARS_PER_TOKEN = 4
+EMBEDDING_DIM = 256
+
+
+def fake_embedding(text):
+    """Hashed bag of words: every word adds 1 to one of EMBEDDING_DIM slots."""
+    vector = [0.0] * EMBEDDING_DIM
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        vector[zlib.crc32(word.encode()) % EMBEDDING_DIM] += 1.0
+    return vector
+
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    """Handles one HTTP connection. Settings are read from the owning MockOllamaServer."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Otherwise keep-alive turns stall on delayed ACKs
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.mock._count_out(len(body))
+
+    def _write_chunk(self, obj):
+        line = (json.dumps(obj) + "\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+        self.server.mock._count_out(len(line))
+
+    def do_GET(self):
+        mock = self.server.mock
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": name, "model": name} for name in mock.models]})
+        elif self.path == "/api/ps":
+            self._send_json({"models": [{"name": name, "model": name} for name in mock.loaded_models]})
+        else:
+            self._send_json({"error": f"unknown endpoint {self.path}"}, status=404)
+
+    def do_POST(self):
+        mock = self.server.mock
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        mock._count_in(length)
+        request = json.loads(raw or b"{}")
+
+        if self.path == "/api/embed":
+            with mock._lock:
+                mock.embed_requests += 1
+            texts = request.get("input", [])
+            if isinstance(texts, str):
+                texts = [texts]
+            self._send_json({"model": request.get("model"), "embeddings": [fake_embedding(t) for t in texts]})
+            return
+
+        if self.path != "/api/chat":
+            self._send_json({"error": f"unknown endpoint {self.path}"}, status=404)
+            return
+
+        # Failure injection
+        if mock.failure_rate and mock._random() < mock.failure_rate:
+            with mock._lock:
+                mock.failures += 1
+            if mock.failure_mode == "disconnect":
+                self.close_connection = True
+                self.connection.close()
+                return
+            self._send_json({"error": "injected failure"}, status=500)
+            return
+
+        with mock._lock:
+            mock.requests_served += 1
+        model = request.get("model", "mock")
+        messages = request.get("messages", [])
+        start = time.perf_counter()
+        load = mock._load(model)
+        if not messages:
+            # Load request: no generation at all
+            self._send_json({"model": model, "message": {"role": "assistant", "content": ""},
+                             "done_reason": "load", "done": True})
+            return
+        reply = mock.replies.get(model, mock.reply)
+        words = reply.split(" ")
+        tokens = [word + " " for word in words[:-1]] + [words[-1]]
+        done_reason = "stop"
+        limit = request.get("options", {}).get("num_predict")
+        if limit is not None and 0 <= limit < len(tokens):
+            tokens = tokens[:limit]
+            done_reason = "length"
+        prompt_tokens = mock._evaluate_prompt(messages, reply)
+
+        time.sleep(mock.latencies.get(model, mock.latency))
+        if mock.prompt_tokens_per_second:
+            time.sleep(prompt_tokens / mock.prompt_tokens_per_second)
+        first_token = time.perf_counter()
+
+        def timings():
+            now = time.perf_counter()
+            return {
+                "done_reason": done_reason,
+                "total_duration": int((now - start) * 1e9),
+                "load_duration": int(load * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int((first_token - start) * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int((now - first_token) * 1e9),
+            }
+
+        if not request.get("stream", True):
+            if mock.tokens_per_second:
+                time.sleep(len(tokens) / mock.tokens_per_second)
+            self._send_json({
+                "model": model,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "done": True,
+                **timings(),
+            })
+            return
+
+        # Streamed reply: NDJSON over chunked transfer encoding
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        step = max(1, mock.chunk_tokens)
+        for i in range(0, len(tokens), step):
+            chunk = tokens[i:i + step]
+            if mock.tokens_per_second:
+                time.sleep(len(chunk) / mock.tokens_per_second)
+            self._write_chunk({"model": model, "message": {"role": "assistant", "content": "".join(chunk)}, "done": False})
+        self._write_chunk({"model": model, "message": {"role": "assistant", "content": ""}, "done": True, **timings()})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class MockOllamaServer:
+    """
+    Local fake of Ollama's /api/chat, /api/embed, /api/tags and /api/ps, served from a background thread.
+    :param latency: Seconds to wait before the first token (simulates queueing + prompt evaluation).
+    :param reply: Text the "model" answers with (one token per word).
+    :param tokens_per_second: Generation speed. None = the whole reply is instant.
+    :param chunk_tokens: Tokens per streamed NDJSON chunk.
+    :param failure_rate: Share of /api/chat requests that fail (0.0 - 1.0).
+    :param failure_mode: "error" (HTTP 500) or "disconnect" (connection dropped without an answer).
+    :param prompt_tokens_per_second: Prompt reading speed. None = instant.
+    :param load_seconds: Seconds the first request for a model that isn't loaded yet spends loading it.
+    :param replies: {model: reply} for models that answer differently from `reply`.
+    :param latencies: {model: seconds} for models faster or slower than `latency`.
+    :param loaded: False = start cold (no model loaded, see /api/ps).
+    :param seed: Seed for the failure injection, so runs are repeatable.
+    """
+    def __init__(self, latency=0.0, reply="This is a mock reply from the local stand-in server.",
+                 tokens_per_second=None, chunk_tokens=1, failure_rate=0.0, failure_mode="error",
+                 prompt_tokens_per_second=None, models=("qwen2.5:14b",), load_seconds=0.0, loaded=True,
+                 replies=None, latencies=None, seed=0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.reply = reply
+        self.replies = dict(replies or {})
+        self.latencies = dict(latencies or {})
+        self.tokens_per_second = tokens_per_second
+        self.chunk_tokens = chunk_tokens
+        self.failure_rate = failure_rate
+        self.failure_mode = failure_mode
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self._cached_prompt = ""  # the last prompt, as the server's prefix cache would hold it
+        self.models = list(models)
+        self.loaded_models = list(models) if loaded else []
+        self.load_seconds = load_seconds
+        self._loading = {}  # model -> Event set once its load finished
+
+        # Counters
+        self.requests_served = 0
+        self.embed_requests = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _OllamaHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._httpd.handle_error = lambda request, client_address: None  # clients hanging up early is fine
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _evaluate_prompt(self, messages, reply):
+        """Tokens that must be read for this prompt: everything after the prefix shared with the previous one."""
+        prompt = "".join(f"<|{m.get('role')}|>{m.get('content', '')}" for m in messages)
+        with self._lock:
+            shared = len(os.path.commonprefix([prompt, self._cached_prompt]))
+            # The cache also holds the reply generated after the prompt
+            self._cached_prompt = prompt + f"<|assistant|>{reply}"
+        return max(1, (len(prompt) - shared) // CHARS_PER_TOKEN)
+
+    def _load(self, model):
+        """Loads model if it isn't loaded yet (requests arriving meanwhile wait for it). Returns the seconds waited."""
+        with self._lock:
+            if model in self.loaded_models:
+                return 0.0
+            loading = self._loading.get(model)
+            owner = loading is None
+            if owner:
+                loading = self._loading[model] = threading.Event()
+        start = time.perf_counter()
+        if owner:
+            time.sleep(self.load_seconds)
+            with self._lock:
+                self.loaded_models.append(model)
+                del self._loading[model]
+            loading.set()
+        else:
+            loading.wait()
+        return time.perf_counter() - start
+
+    def _random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _count_in(self, n):
+        with self._lock:
+            self.bytes_in += n
+
+    def _count_out(self, n):
+        with self._lock:
+            self.bytes_out += n
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests_served = self.embed_requests = self.failures = self.bytes_in = self.bytes_out = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    with MockOllamaServer(latency=0.2, tokens_per_second=30) as server:
+        print(f"🧪 Mock Ollama running at {server.url} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
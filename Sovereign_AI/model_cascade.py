@@ -0,0 +1,170 @@
+### MODEL CASCADE
+# Optional routing for SovereignClient: every turn is first tried on a small, fast model,
+# and only goes to the big model (qwen2.5:14b) when the small model's reply isn't good enough.
+# Trivial calls (short hints, simple commands) then cost a fraction of the GPU time and latency.
+# A reply is escalated when:
+#   - it was requested as JSON and doesn't parse / breaks the schema
+#   - it was cut off at max_reply_tokens (the answer needs more than a quick reply), or is too short
+#   - the small model flags its own uncertainty (it is told to answer with ESCALATE_MARKER when unsure)
+# Rules are set per persona: matched by a piece of text in the system prompt (e.g. "Examiner"),
+# so grading can always go to the big model while tutoring hints stay on the small one.
+# Streamed turns stream the small model too: its first hold_chars are held back and checked for uncertainty,
+# after that the reply is shown live and kept (text on screen can't be taken back, so no reply cap applies).
+# JSON replies are always judged whole (a schema can only be checked on the complete reply).
+# we have CascadeRule --> when the small model may answer, and when its reply is accepted
+# we have ModelCascade --> what the client talks to: picks the rule, builds the small request, judges the reply,
+#                          keeps the stats (share escalated, latency saved)
+# The small model must be pulled on the server too:  ollama pull qwen2.5:3b
+#
+# Usage:
+#     cascade = ModelCascade("qwen2.5:3b", rules={"Examiner": CascadeRule(enabled=False)})
+#     bot = SovereignClient(URL, cascade=cascade)
+#     print(cascade.summary())
+
+import json
+import threading
+
+from structured_output import validate, strip_fences
+
+ESCALATE_MARKER = "[ESCALATE]"
+ESCALATE_INSTRUCTION = (
+    f"\n\nIf you are not confident you can answer this correctly and completely, "
+    f"reply with exactly {ESCALATE_MARKER} and nothing else."
+)
+
+
+class CascadeRule:
+    """
+    How one persona uses the cascade.
+    :param enabled: False = always the big model (for work where quality matters most, e.g. grading).
+    :param max_prompt_tokens: Conversations longer than this skip the small model (None = no limit).
+    :param max_reply_tokens: The small model's reply limit (non-streamed calls). A reply cut off there is escalated.
+    :param min_reply_chars: Shorter replies are escalated.
+    :param uncertainty_markers: Escalate if the reply contains one of these (case-insensitive).
+    :param ask_to_flag: Tell the small model to answer ESCALATE_MARKER when unsure.
+    :param hold_chars: Streamed turns: the small model's reply is held back until it is this long (checked for
+                       uncertainty markers so far), then shown live and kept.
+    """
+    def __init__(self, enabled=True, max_prompt_tokens=None, max_reply_tokens=256, min_reply_chars=1,
+                 uncertainty_markers=(ESCALATE_MARKER, "i'm not sure", "i am not sure", "i don't know"),
+                 ask_to_flag=True, hold_chars=48):
+        self.enabled = enabled
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_reply_tokens = max_reply_tokens
+        self.min_reply_chars = min_reply_chars
+        self.uncertainty_markers = tuple(marker.lower() for marker in uncertainty_markers)
+        self.ask_to_flag = ask_to_flag
+        self.hold_chars = hold_chars
+
+
+class ModelCascade:
+    """
+    Small model first, big model only when needed.
+    :param small_model: The fast Ollama model tried first (must be pulled on the server).
+    :param rules: {text in the system prompt: CascadeRule}, checked in order; the first match applies.
+    :param default: Rule for personas no entry matches (default: CascadeRule()).
+    """
+    def __init__(self, small_model="qwen2.5:3b", rules=None, default=None):
+        self.small_model = small_model
+        self.rules = dict(rules or {})
+        self.default = default if default is not None else CascadeRule()
+        self._lock = threading.Lock()
+        self.stats = {"tried": 0, "accepted": 0, "escalated": 0, "direct": 0, "reasons": {},
+                      "small_seconds_accepted": 0.0, "small_seconds_escalated": 0.0,
+                      "large_calls": 0, "large_seconds": 0.0}
+
+    def rule_for(self, system_prompt):
+        for match, rule in self.rules.items():
+            if match in system_prompt:
+                return rule
+        return self.default
+
+    def should_try(self, rule, prompt_tokens):
+        """Whether this turn goes to the small model first (if not, it is counted as direct)."""
+        if rule.enabled and (rule.max_prompt_tokens is None or prompt_tokens <= rule.max_prompt_tokens):
+            return True
+        with self._lock:
+            self.stats["direct"] += 1
+        return False
+
+    def small_payload(self, payload, rule, stream=False):
+        """
+        The request for the small model: same conversation. Non-streamed, the reply is capped at max_reply_tokens;
+        streamed it isn't (once shown, a reply is kept, and a cut-off one would be worse than a long one).
+        """
+        messages = list(payload["messages"])
+        if rule.ask_to_flag and messages and messages[0]["role"] == "system":
+            messages[0] = {"role": "system", "content": messages[0]["content"] + ESCALATE_INSTRUCTION}
+        options = dict(payload.get("options", {}))
+        if not stream:
+            options["num_predict"] = rule.max_reply_tokens
+        return dict(payload, model=self.small_model, messages=messages, stream=stream, options=options)
+
+    def judge(self, rule, data, format=None, partial=False):
+        """
+        Why the small model's reply must be escalated, or None if it is good enough.
+        :param partial: The reply is still streaming (held back): only what can be judged so far is checked.
+        """
+        text = data.get("message", {}).get("content", "")
+        if partial:
+            lowered = text.lower()
+            return "uncertain" if any(marker in lowered for marker in rule.uncertainty_markers) else None
+        if data.get("done_reason") == "length":
+            return "truncated"
+        if len(text.strip()) < rule.min_reply_chars:
+            return "too short"
+        lowered = text.lower()
+        if any(marker in lowered for marker in rule.uncertainty_markers):
+            return "uncertain"
+        if format is not None:
+            try:
+                parsed = json.loads(strip_fences(text))
+            except ValueError:
+                return "invalid JSON"
+            if isinstance(format, dict) and validate(parsed, format):
+                return "schema"
+        return None
+
+    def record_small(self, seconds, reason):
+        """Counts one small-model try (reason None = accepted)."""
+        with self._lock:
+            self.stats["tried"] += 1
+            if reason is None:
+                self.stats["accepted"] += 1
+                self.stats["small_seconds_accepted"] += seconds
+            else:
+                self.stats["escalated"] += 1
+                self.stats["small_seconds_escalated"] += seconds
+                self.stats["reasons"][reason] = self.stats["reasons"].get(reason, 0) + 1
+
+    def record_large(self, seconds):
+        """Counts one big-model call (escalated or direct), for the latency saved estimate."""
+        with self._lock:
+            self.stats["large_calls"] += 1
+            self.stats["large_seconds"] += seconds
+
+    @property
+    def escalation_rate(self):
+        """Share of small-model tries that had to go to the big model."""
+        tried = self.stats["tried"]
+        return self.stats["escalated"] / tried if tried else 0.0
+
+    @property
+    def latency_saved(self):
+        """
+        Estimated seconds saved so far: accepted replies at the big model's average latency minus what the
+        small model actually took (including the time lost on escalated tries). None until the big model was timed.
+        """
+        s = self.stats
+        if not s["large_calls"]:
+            return None
+        large_mean = s["large_seconds"] / s["large_calls"]
+        return s["accepted"] * large_mean - s["small_seconds_accepted"] - s["small_seconds_escalated"]
+
+    def summary(self):
+        s = self.stats
+        saved = self.latency_saved
+        reasons = ", ".join(f"{reason} {count}" for reason, count in s["reasons"].items()) or "none"
+        return (f"🪜 Cascade: {s['accepted']}/{s['tried']} answered by {self.small_model}, "
+                f"{s['escalated']} escalated ({self.escalation_rate:.0%}; {reasons}), {s['direct']} direct. "
+                f"Latency saved: {'n/a' if saved is None else f'{saved:.1f}s'}")
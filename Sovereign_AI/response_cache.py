@@ -0,0 +1,123 @@
+### RESPONSE CACHE
+# Remembers answers to identical requests so they don't cost another GPU round trip.
+# Meant for deterministic, low-temperature calls (e.g. the ROS node planning on repeated sensor states).
+# Two tiers:
+#   1. In-memory LRU, bounded by max_entries and ttl (seconds).
+#   2. Optional on-disk SQLite file (path=...), so cached answers survive restarts (expired rows are pruned on write).
+# By default a reply is only reused for the exact same conversation. With key_on="prompt" the key ignores the
+# earlier turns (only the persona, the new message and the options count), so a repeated prompt hits mid-conversation:
+# for stateless-style callers like the ROS node, whose answer depends on the sensor state, not on the history.
+#
+# Usage:
+#     bot = SovereignClient(URL, cache=ResponseCache(max_entries=512, ttl=600, path="brain_cache.db"))
+#     print(bot.cache.stats())
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of AI replies, keyed on a hash of model, messages and options.
+    :param max_entries: Max replies kept in memory (least recently used are dropped first).
+    :param ttl: Seconds a reply stays valid (None = forever).
+    :param path: Optional SQLite file for the persistent tier.
+    :param key_on: "conversation" (the whole message history) or "prompt" (system messages + the new message only).
+    """
+    def __init__(self, max_entries=256, ttl=300, path=None, key_on="conversation"):
+        if key_on not in ("conversation", "prompt"):
+            raise ValueError(f"key_on must be 'conversation' or 'prompt', not {key_on!r}")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.key_on = key_on
+        self._entries = OrderedDict()  # key -> (created_at, reply)
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS replies (key TEXT PRIMARY KEY, created REAL, reply TEXT)")
+            self._db.commit()
+
+    def make_key(self, payload):
+        """Hash of everything that decides the answer (model, messages, options). 'stream' is ignored."""
+        messages = payload.get("messages") or []
+        if self.key_on == "prompt":
+            # Persona (and recalled memory) + the new message onwards: earlier turns don't change the key
+            new = max((i for i, m in enumerate(messages) if m["role"] == "user"), default=len(messages))
+            messages = [m for m in messages[:new] if m["role"] == "system"] + messages[new:]
+        material = json.dumps(
+            [payload.get("model"), messages, payload.get("options"), payload.get("format")],
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key):
+        """Returns the cached reply for this key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT created, reply FROM replies WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[0]):
+                    self._store_in_memory(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return row[1]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, reply):
+        """Stores a reply in both tiers."""
+        created = time.time()
+        with self._lock:
+            self._store_in_memory(key, created, reply)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO replies VALUES (?, ?, ?)", (key, created, reply))
+                if self.ttl is not None:
+                    self._db.execute("DELETE FROM replies WHERE created < ?", (created - self.ttl,))
+                self._db.commit()
+
+    def _store_in_memory(self, key, created, reply):
+        self._entries[key] = (created, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Empties both tiers and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM replies")
+                self._db.commit()
+            self.hits = self.disk_hits = self.misses = 0
+
+    def stats(self):
+        """Hit/miss counters. hit_rate counts memory and disk hits."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
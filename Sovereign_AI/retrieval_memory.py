@@ -0,0 +1,180 @@
+### RETRIEVAL MEMORY
+# Optional long-term memory for SovereignClient.
+# Turns that leave the window (dropped by the sliding window, or folded into a summary) are not lost:
+# they are embedded with Ollama's /api/embed and kept in a small vector index.
+# Before every new prompt, the most similar old turns are looked up and added to the request
+# (within a token budget), so long sessions keep their recall while the window itself stays small.
+# we have VectorIndex --> NumPy matrix of normalized embeddings, cosine top-k for many queries at once
+# we have RetrievalMemory --> what the client talks to: queues evicted turns, picks snippets for a prompt
+# Requires numpy:  pip install numpy   (and an embedding model on the server:  ollama pull nomic-embed-text)
+#
+# Usage:
+#     bot = SovereignClient(URL, memory=RetrievalMemory(k=3, budget_tokens=512), context_tokens=2048)
+
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency: only needed for retrieval memory
+    np = None
+
+from sovereign_client import estimate_tokens
+
+
+class VectorIndex:
+    """
+    Embeddings stored as rows of one float32 matrix, L2-normalized on insert,
+    so cosine similarity is a single matrix product. The matrix grows by doubling.
+    """
+    def __init__(self, capacity=256):
+        if np is None:
+            raise ImportError("Retrieval memory needs numpy. Install it with: pip install numpy")
+        self.capacity = capacity
+        self._vectors = None  # allocated on the first add, once the dimension is known
+        self.texts = []
+
+    def __len__(self):
+        return len(self.texts)
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def add(self, vectors, texts):
+        """Adds a batch of embeddings (one row per text)."""
+        batch = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1))
+        size = len(self.texts)
+        if self._vectors is None:
+            self._vectors = np.empty((max(self.capacity, len(batch)), batch.shape[1]), dtype=np.float32)
+        elif size + len(batch) > len(self._vectors):
+            grown = np.empty((max(2 * len(self._vectors), size + len(batch)), self._vectors.shape[1]), dtype=np.float32)
+            grown[:size] = self._vectors[:size]
+            self._vectors = grown
+        self._vectors[size:size + len(batch)] = batch
+        self.texts.extend(texts)
+
+    def search(self, queries, k):
+        """
+        Cosine top-k for every query row at once.
+        Returns one [(score, text), ...] list per query, best first.
+        """
+        size = len(self.texts)
+        if size == 0:
+            return [[] for _ in range(len(queries))]
+        k = min(k, size)
+        scores = self._normalize(np.asarray(queries, dtype=np.float32)) @ self._vectors[:size].T
+        # argpartition finds the k best in O(n), only those k get sorted
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(scores, best):
+            ordered = candidates[np.argsort(-row[candidates])]
+            results.append([(float(row[i]), self.texts[i]) for i in ordered])
+        return results
+
+    def clear(self):
+        self._vectors = None
+        self.texts = []
+
+
+class RetrievalMemory:
+    """
+    Long-term memory of turns that left the window.
+    :param embed_model: Ollama embedding model (must be pulled on the server).
+    :param k: Max snippets added to a prompt.
+    :param budget_tokens: Max tokens of snippets added to a prompt (the window shrinks by this much to make room).
+    :param min_score: Snippets less similar than this (cosine) are never added.
+    :param batch_size: Evicted snippets embedded per request.
+    """
+    def __init__(self, embed_model="nomic-embed-text", k=3, budget_tokens=512, min_score=0.35, batch_size=32):
+        self.embed_model = embed_model
+        self.k = k
+        self.budget_tokens = budget_tokens
+        self.min_score = min_score
+        self.batch_size = batch_size
+        self.index = VectorIndex()
+        self.pending = []       # evicted messages waiting to be embedded
+        self.stats = {"archived": 0, "recalls": 0, "recalled_snippets": 0, "recalled_tokens": 0}
+        self._lock = threading.Lock()
+        self._archiving = False
+        self._generation = 0    # bumped by clear(), so embeddings of wiped turns are thrown away
+
+    def evict(self, messages):
+        """Queues messages that left the window (cheap: embedding happens later, off the critical path)."""
+        with self._lock:
+            self.pending.extend(m for m in messages if m["role"] != "system")
+
+    def claim_pending(self):
+        """
+        Takes the queued messages as snippets (one per user + AI turn) for a worker to embed.
+        Returns (generation, snippets), or None if there is nothing to do or a worker is already busy.
+        """
+        with self._lock:
+            if self._archiving or not self.pending:
+                return None
+            messages, self.pending = self.pending, []
+            self._archiving = True
+            generation = self._generation
+
+        snippets, current = [], []
+        for message in messages:
+            if message["role"] == "user" and current:
+                snippets.append("\n".join(current))
+                current = []
+            label = "USER" if message["role"] == "user" else "AI"
+            current.append(f"{label}: {message['content']}")
+        if current:
+            snippets.append("\n".join(current))
+        return generation, snippets
+
+    def store(self, generation, snippets, vectors):
+        """Adds embedded snippets to the index (dropped if the memory was cleared meanwhile)."""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.index.add(vectors, snippets)
+            self.stats["archived"] += len(snippets)
+
+    def done_archiving(self):
+        with self._lock:
+            self._archiving = False
+
+    def batches(self, snippets):
+        for i in range(0, len(snippets), self.batch_size):
+            yield snippets[i:i + self.batch_size]
+
+    def recall(self, query_vector):
+        """
+        The most relevant old snippets for a prompt, as a message to add to the request (None if nothing fits).
+        """
+        with self._lock:
+            results = self.index.search([query_vector], self.k)[0]
+        picked, used = [], 0
+        for score, text in results:
+            if score < self.min_score:
+                break
+            tokens = estimate_tokens(text)
+            if used + tokens > self.budget_tokens:
+                continue
+            picked.append(text)
+            used += tokens
+        if not picked:
+            return None
+        self.stats["recalls"] += 1
+        self.stats["recalled_snippets"] += len(picked)
+        self.stats["recalled_tokens"] += used
+        return {
+            "role": "system",
+            "content": "RELEVANT EARLIER CONVERSATION (recalled from long-term memory):\n\n" + "\n\n".join(picked)
+        }
+
+    def clear(self):
+        """Forgets everything (called when the conversation memory is wiped)."""
+        with self._lock:
+            self.index.clear()
+            self.pending = []
+            self._generation += 1
+
+    def __len__(self):
+        return len(self.index)
@@ -3,16 +3,23 @@ import rclpy
 from rclpy.node import Node
 from std_msgs.msg import String
 import json
+import threading
 import time
 
 # IMPORT YOUR CLIENT
 # Ensure sovereign_client.py is in the same folder or in your python path
+from errors import SovereignError
+from model_cascade import ModelCascade
+from response_cache import ResponseCache
 from sovereign_client import SovereignClient
+from state_gate import StateGate
+from structured_output import validate
 
 # ==============================================================================
 #                               CONFIG SECTION
 # ==============================================================================
 # The Ngrok URL from your Colab Session
+# (or a list of URLs from several sessions: the brain routes between them and fails over)
 LLM_URL = "https://oldfangled-uniambic-aryanna.ngrok-free.dev"
 
 # The "Job Description" for this specific robot
@@ -24,6 +31,54 @@ OUTPUT: A strictly formatted JSON object with the next high-level command.
 SCHEMA: { "action": "string", "parameters": [list], "reasoning": "string" }
 Do not use Markdown. Do not include preamble.
 """
+
+# The same schema, enforced by the server (Ollama "format") and validated on arrival.
+# "reasoning" comes last so "action" and "parameters" are generated (and usable) first.
+COMMAND_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "action": {"type": "string"},
+        "parameters": {"type": "array"},
+        "reasoning": {"type": "string"}
+    },
+    "required": ["action", "parameters", "reasoning"]
+}
+
+# Publish as soon as "action" and "parameters" have streamed in, without waiting for "reasoning".
+ACT_EARLY = True
+
+# How many LLM requests may run at once. Inputs that arrive while all workers are
+# busy are NOT queued: only the newest one is kept (latest wins), older ones are dropped as stale.
+# Each worker keeps its own conversation with the brain (the first one uses it, the others fork it).
+MAX_IN_FLIGHT = 1
+
+# Queue class on a server running the priority gateway: planning calls jump ahead of chat traffic
+LLM_PRIORITY = "high"
+
+# CHANGE GATING: only ask the brain again when the state changed significantly (see state_gate.py).
+# Fields are dotted paths into the input JSON; an entry also covers everything inside it ("pose" -> "pose.x").
+# Numeric changes up to the tolerance are treated as noise; fields without one must match exactly.
+STATE_TOLERANCES = {"battery": 5.0, "pose": 0.2}
+DEFAULT_TOLERANCE = 0.0
+IGNORED_FIELDS = {"timestamp", "stamp", "seq", "header"}
+# Re-plan at least this often (seconds), even if nothing changed
+MAX_PLAN_AGE = 10.0
+# What to do with an unchanged state: "republish" the last plan (stamped with the new input), or "hold" (stay quiet)
+ON_UNCHANGED = "republish"
+# How often (seconds) the gate counters are logged
+GATE_LOG_PERIOD = 30.0
+
+# PLAN CACHE: a state sent again word-for-word gets the plan made for it last time, without a GPU call.
+# Keyed on the persona + the state only (not on the conversation so far), kept PLAN_CACHE_TTL seconds
+# in memory and in PLAN_CACHE_PATH (None = memory only). Set PLAN_CACHE_TTL = 0 to turn it off.
+# (Only exact repeats hit: inputs carrying a timestamp never do, the gate above handles those.)
+PLAN_CACHE_TTL = 300
+PLAN_CACHE_PATH = "brain_cache.db"
+
+# MODEL CASCADE: a small, fast model plans first, the 14B only takes over when the small model's
+# command breaks COMMAND_SCHEMA, gets cut off, or it isn't sure (None = every plan comes from the 14B).
+# Pull it on the server too:  ollama pull qwen2.5:3b
+CASCADE_MODEL = None
 # ==============================================================================
 
 class RosBrainNode(Node):
@@ -31,8 +86,15 @@ class RosBrainNode(Node):
         super().__init__('sovereign_brain_node')
         
         # 1. Initialize the Cloud Brain
-        self.brain = SovereignClient(LLM_URL)
+        self.cascade = ModelCascade(CASCADE_MODEL) if CASCADE_MODEL else None
+        cache = ResponseCache(ttl=PLAN_CACHE_TTL, path=PLAN_CACHE_PATH, key_on="prompt") if PLAN_CACHE_TTL else None
+        self.brain = SovereignClient(LLM_URL, priority=LLM_PRIORITY, client_id=self.get_name(),
+                                     cascade=self.cascade, cache=cache)
         self.brain.set_persona(ROBOT_PERSONA)
+        # Log where the time of every inference went (network, prompt reading, generation)
+        self.brain.telemetry.add_hook(
+            lambda metrics: self.get_logger().info(f"⏱️ {metrics.breakdown()}")
+        )
         self.get_logger().info("🧠 Sovereign Brain Connected to Cloud.")
 
         # 2. THE EARS (Subscriber)
@@ -52,38 +114,145 @@ class RosBrainNode(Node):
         # Message Type: String (JSON formatted)
         self.publisher_ = self.create_publisher(String, '/brain/output', 10)
 
+        # 4. THE GATE
+        # Inputs that didn't change significantly since the last plan never reach the brain
+        self.gate = StateGate(STATE_TOLERANCES, IGNORED_FIELDS, DEFAULT_TOLERANCE, MAX_PLAN_AGE)
+        self._last_command = None # last published plan, and the input it was planned for (for republishing)
+        self._last_command_input = None
+        self.create_timer(GATE_LOG_PERIOD, self._log_gate_stats)
+
+        # 5. THE THINKING THREADS
+        # Inference runs off the executor thread so the subscriber never blocks.
+        # _latest is a single slot: a new input simply overwrites an older one that hasn't started yet.
+        self._latest = None
+        self._slot = threading.Condition()
+        self._running = True
+        self.dropped_inputs = 0
+        # Each worker talks through its own conversation (a fork of the brain), so concurrent
+        # calls never interleave their turns in one history. They share servers, telemetry and cache.
+        self._workers = [
+            threading.Thread(target=self._inference_worker, args=(self.brain if i == 0 else self.brain.fork(),),
+                             daemon=True)
+            for i in range(MAX_IN_FLIGHT)
+        ]
+        for worker in self._workers:
+            worker.start()
+
         self.get_logger().info("✅ Brain Node Ready. Waiting for input on '/brain/input'...")
 
     def listener_callback(self, msg):
         """
         Triggered whenever the robot sends a status update.
+        Unchanged states are answered with the last plan (or nothing) right here.
+        Others are only stored in the slot (latest wins); a worker thread does the thinking.
         """
-        sensor_data = msg.data
+        stamp = self.get_clock().now().nanoseconds / 1e9
+        reason = self.gate.check(msg.data)
+        if reason is None:
+            if ON_UNCHANGED == "republish":
+                self.republish_command(stamp)
+            return
+        self.get_logger().debug(f"🚦 Planning ({reason})")
+        with self._slot:
+            if self._latest is not None:
+                self.dropped_inputs += 1 # superseded before anyone started on it
+            self._latest = (msg.data, stamp)
+            self._slot.notify()
+
+    def _inference_worker(self, brain):
+        """Waits for the newest input, then thinks about it with `brain`. One worker = one request in flight."""
+        while True:
+            with self._slot:
+                while self._running and self._latest is None:
+                    self._slot.wait()
+                if not self._running:
+                    return
+                sensor_data, stamp = self._latest
+                self._latest = None
+            self.think(brain, sensor_data, stamp)
+
+    def think(self, brain, sensor_data, stamp):
+        """Sends one sensor state to `brain` (this worker's conversation) and publishes the resulting command."""
         self.get_logger().info(f"📥 Received: {sensor_data}")
+        started = time.perf_counter()
+        fields = {}
+        published = []
+
+        def on_field(key, value):
+            # Act on the command fields before the reasoning has finished generating
+            fields[key] = value
+            if ACT_EARLY and not published and "action" in fields and "parameters" in fields:
+                command = {"action": fields["action"], "parameters": fields["parameters"]}
+                if not validate(command, {**COMMAND_SCHEMA, "required": ["action", "parameters"]}):
+                    self.publish_command(command, stamp, started, sensor_data)
+                    published.append(True)
 
         # 1. THINK (Send to Colab)
-        # We use a low temperature for predictable JSON control
+        # We use a low temperature for predictable JSON control.
+        # 2. VALIDATE happens inside chat_json (server-side format + schema check)
         try:
-            ai_response = self.brain.chat(f"Current State: {sensor_data}", temperature=0.1)
-            
-            # Clean response just in case the AI added markdown
-            clean_json = ai_response.replace("```json", "").replace("```", "").strip()
-            
-            # 2. VALIDATE
-            # Ensure it's valid JSON before publishing
-            json.loads(clean_json) 
+            command = brain.chat_json(f"Current State: {sensor_data}", schema=COMMAND_SCHEMA,
+                                           temperature=0.1, on_field=on_field)
+            if command is None:
+                self.get_logger().error(
+                    f"❌ AI returned bad JSON {brain.last_json_errors} "
+                    f"(malformed rate {brain.malformed_rate:.0%})"
+                )
+                if not published:
+                    self.gate.failed(sensor_data)
+                return
 
             # 3. ACT (Publish Command)
-            cmd_msg = String()
-            cmd_msg.data = clean_json
-            self.publisher_.publish(cmd_msg)
-            self.get_logger().info(f"out -> 📤 Command Published: {clean_json}")
+            if published:
+                self.get_logger().info(f"💭 Reasoning: {command.get('reasoning')}")
+            else:
+                self.publish_command(command, stamp, started, sensor_data)
 
-        except json.JSONDecodeError:
-            self.get_logger().error(f"❌ AI hallucinated bad JSON: {ai_response}")
+        except SovereignError as e:
+            # The failed call left no trace in the brain's memory: the next sensor update just tries again
+            self.gate.failed(sensor_data)
+            self.get_logger().error(f"❌ Brain unavailable ({type(e).__name__}): {e}")
         except Exception as e:
+            self.gate.failed(sensor_data)
             self.get_logger().error(f"❌ System Error: {e}")
 
+    def publish_command(self, command, stamp, started, sensor_data):
+        """Publishes a command, stamped so downstream nodes can reject stale plans."""
+        latency = time.perf_counter() - started
+        command = dict(command, input_stamp=stamp, inference_latency=round(latency, 3))
+        self._last_command, self._last_command_input = command, sensor_data
+        cmd_msg = String()
+        cmd_msg.data = json.dumps(command)
+        self.publisher_.publish(cmd_msg)
+        self.get_logger().info(f"out -> 📤 Command Published ({latency:.2f}s): {cmd_msg.data}")
+
+    def republish_command(self, stamp):
+        """
+        Publishes the last plan again for an unchanged input, stamped with the new input
+        (plan_stamp says which input it was actually planned for).
+        Nothing while the plan for the current state is still being made (the older plan is for another state).
+        """
+        command, planned_for = self._last_command, self._last_command_input
+        if command is None or planned_for is not self.gate.reference:
+            return
+        cmd_msg = String()
+        cmd_msg.data = json.dumps(dict(command, input_stamp=stamp, plan_stamp=command["input_stamp"], reused=True))
+        self.publisher_.publish(cmd_msg)
+
+    def _log_gate_stats(self):
+        """Timer: how many LLM calls the gate (and the cascade) saved."""
+        if self.gate.stats["received"]:
+            self.get_logger().info(f"{self.gate.summary()}, {self.dropped_inputs} superseded while busy")
+        if self.cascade is not None and self.cascade.stats["tried"]:
+            self.get_logger().info(self.cascade.summary())
+
+    def destroy_node(self):
+        """Stops the worker threads before shutting down."""
+        with self._slot:
+            self._running = False
+            self._slot.notify_all()
+        return super().destroy_node()
+
 def main(args=None):
     rclpy.init(args=args)
     node = RosBrainNode()
@@ -3,87 +3,1095 @@
 # It manages the conversation history, personas, and handles communication.
 # we have init --> this initiates model for use (with a system prompt)
 # we have reset_history --> ai forgets all chats 
-# we have chat --> allows for LLM use (with temperature control
+# we have chat --> allows for LLM use (with temperature control, and optional live token streaming)
+# we have chat_stream --> generator version of chat, yields tokens as the server produces them
+# we have chat_json --> structured output: asks for JSON (optionally matching a schema), validates and parses it
+# we have chat_many --> batch mode: runs many independent prompts at once (offline jobs), resumable via a checkpoint file
+# we have health --> cheap readiness probe (/api/tags + /api/ps): server reachable? model pulled? model loaded in VRAM?
+# we have warm_up --> loads the model into VRAM in the background (no generation), so the first turn doesn't wait for it
 # Has reasonable memory garbage collection to avoid overloading context window, yet maintain long conversations.
+#   (the window is measured in tokens, not messages: oldest turns are dropped until the prompt + reply fit)
+#   (turns are dropped in big chunks, rarely, so the prompt prefix stays identical and Ollama can reuse its cache)
 # we have set_persona --> allows changing of system prompt
 # we have clear_memory --> wipes all chat history but keeps persona
 # we have forget_last --> removes last user + ai message
+# we have open_session --> switches to (or resumes) a conversation kept in the store
+# we have fork --> independent copy of the conversation, for speculative requests in the background
+# we have extend_last_reply --> appends text to the last AI reply (e.g. to splice in a prefetched answer)
 # we have compress_memory --> advanced feature to summarize chat history into a single message to save space
+#   (or set auto_compress_tokens and old turns get folded into a rolling summary in the background)
+# Optional conversation store (store=SQLiteStore(...), session_id=...) keeps every turn on disk and resumes it later
+# Optional retrieval memory (memory=RetrievalMemory(...)) embeds turns that leave the window and recalls relevant ones
+# Optional response cache (cache=ResponseCache(...)) answers repeated low-temperature requests locally
+# Optional model cascade (cascade=ModelCascade(...)) tries a small, fast model first and only
+#   escalates to this client's model when the small reply isn't good enough (see model_cascade.py)
+# Every call's timing (Ollama's durations + network time) goes to bot.last_metrics and bot.telemetry
+# Give it several server URLs and it routes each turn to the best one, failing over if one dies (see endpoint_pool.py)
+# Behind the server's priority gateway, priority= / client_id= pick the queue (queue wait shows up in bot.last_metrics)
+# Connections are pooled: all clients in one process share keep-alive sessions (see get_session)
+# A failed turn raises a SovereignError (see errors.py) and is rolled back, so it can simply be sent again.
+#   (timeouts follow the latency seen so far, a server failing in a row trips a circuit breaker so calls fail
+#    at once instead of hanging, and hedge=True re-sends a request that is slower than usual)
 # This client can be used in any local Python environment to connect to the Colab-hosted AI.
 
 import requests
+from requests.adapters import HTTPAdapter
+import copy
 import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+from endpoint_pool import EndpointPool, has_model
+from errors import SovereignError, ServerUnreachable, RequestTimeout, ServerError, ServerBusy, CircuitOpen
+from structured_output import IncrementalJSONParser, validate, strip_fences
+from telemetry import Telemetry, TurnMetrics, Histogram, queue_wait_from
+
+# ==============================================================================
+#                           SHARED CONNECTION POOL
+# ==============================================================================
+# Opening a new TCP + TLS connection to the ngrok edge costs hundreds of ms.
+# Every client in this process reuses the same keep-alive session (one per pool size),
+# so only the very first request pays the handshake.
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+def get_session(pool_size=10):
+    """
+    Returns the process-wide keep-alive session for this pool size (created on first use).
+    :param pool_size: Max idle connections kept open per host.
+    """
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(pool_size)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _SESSIONS[pool_size] = session
+        return session
+
+# ==============================================================================
+#                           TOKEN ESTIMATION
+# ==============================================================================
+# A real tokenizer is slow and model specific. ~4 characters per token is a good
+# estimate for English text and code with Qwen/Llama tokenizers, plus a few tokens
+# per message for the chat template (role markers etc).
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 4
+
+def estimate_tokens(text):
+    """Fast local estimate of how many tokens a message costs."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN + TOKENS_PER_MESSAGE
+
+# ==============================================================================
+#                               TIMEOUTS
+# ==============================================================================
+# Opening a connection takes well under a second, or it isn't going to work at all.
+CONNECT_TIMEOUT = 10
+# The wait for an answer is timeout_factor x the p99 latency seen so far (once there are
+# this many calls to go by): a stuck request is given up on long before the 2 minute maximum.
+# Latencies are kept per kind of request (model, streamed or not): a fast small model or short
+# streamed turns must not set the timeout of a slow 14B call.
+MIN_LATENCY_SAMPLES = 20
+# ngrok answers by itself (with this header) when the tunnel is there but Colab behind it is gone
+NGROK_ERROR_HEADER = "ngrok-error-code"
 
 class SovereignClient:
     """
     The Universal Client for your Cloud AI.
     Handles connection, memory management, and personas.
     """
-    def __init__(self, api_url, model="qwen2.5:14b", system_prompt="You are a helpful assistant."):
-        # Clean the URL (User often pastes with or without slash)
-        self.api_url = api_url.rstrip('/') + "/api/chat"
+    def __init__(self, api_url, model="qwen2.5:14b", system_prompt="You are a helpful assistant.",
+                 pool_size=10, session=None, context_tokens=4096, reply_tokens=512, trim_target=0.6,
+                 keep_alive="30m",
+                 auto_compress_tokens=None, keep_recent_tokens=None,
+                 cache=None, cache_max_temperature=0.3, telemetry=None, routing="least_outstanding",
+                 store=None, session_id=None, priority=None, client_id=None, memory=None,
+                 timeout=None, min_timeout=30, max_timeout=120, timeout_factor=3.0, hedge=False,
+                 breaker_threshold=2, breaker_cooldown=30.0, cascade=None):
+        """
+        :param api_url: Server URL, a list of server URLs, or an EndpointPool.
+        :param pool_size: Size of the shared keep-alive connection pool.
+        :param session: Optional requests.Session to use instead of the shared one.
+        :param context_tokens: Server context window (sent to Ollama as num_ctx).
+        :param reply_tokens: Room kept free in the window for the AI's reply.
+        :param trim_target: When the window overflows, old turns are dropped until only this share of the
+                            budget is used (1.0 = drop as little as possible, but then on every turn).
+        :param keep_alive: How long Ollama keeps the model loaded in VRAM after a request (e.g. "30m", -1 = forever).
+        :param auto_compress_tokens: If set, once history grows past this many tokens the oldest
+                                     turns are summarized in the background (None = manual only).
+        :param keep_recent_tokens: How much recent conversation stays word-for-word when
+                                   auto-compressing (default: half of auto_compress_tokens).
+        :param cache: Optional ResponseCache. Identical requests are answered from it instead of the server.
+        :param cache_max_temperature: The cache is bypassed above this temperature (random replies shouldn't repeat).
+        :param telemetry: Optional Telemetry to record into (share one between clients to aggregate them).
+        :param routing: With several URLs: "least_outstanding" or "lowest_latency".
+        :param store: Optional ConversationStore. Every turn is written to it as it happens.
+        :param session_id: Conversation to resume from the store (with its stored persona), or to start.
+                           Default: a new random ID.
+        :param priority: "high", "normal" or "low": queue class on a server running the priority gateway.
+        :param client_id: Name the gateway schedules fairly by (default: this machine's address).
+        :param memory: Optional RetrievalMemory. Turns leaving the window are embedded, and the most relevant
+                       ones are added back to each prompt (within memory.budget_tokens).
+        :param timeout: Fixed seconds to wait for the server's answer (default: adaptive, see below).
+        :param min_timeout: Adaptive timeout floor (leaves room for the model being reloaded into VRAM).
+        :param max_timeout: Adaptive timeout ceiling, used until enough calls were seen.
+        :param timeout_factor: Adaptive timeout = this x the p99 latency seen so far (clamped to min/max).
+        :param hedge: If True, a non-streamed request still unanswered after the usual p95 latency is sent
+                      a second time (to another server if there is one) and the first answer wins.
+                      Costs duplicate GPU work on slow calls, in exchange for a shorter tail.
+        :param breaker_threshold: Failures in a row before a server is skipped (circuit breaker).
+        :param breaker_cooldown: Seconds a failing server is skipped. While every server is skipped,
+                                 calls raise CircuitOpen at once instead of waiting for a timeout.
+        :param cascade: Optional ModelCascade. Each call goes to its small model first, and to `model` only
+                        when the cascade's rule for the current persona rejects the small model's reply.
+        """
         self.model = model
         
+        # Pooled keep-alive connection (shared with every other client in this process)
+        self.session = session if session is not None else get_session(pool_size)
+        
         # Headers to bypass Ngrok's "Phishing Warning" page
         self.headers = {
             "ngrok-skip-browser-warning": "true",
             "Content-Type": "application/json"
         }
+        # Optional priority gateway on the server: which queue we go in, and who we are for fair turns
+        if priority is not None:
+            self.headers["X-Priority"] = priority
+        if client_id is not None:
+            self.headers["X-Client-Id"] = client_id
+        
+        # Servers to talk to (URLs are cleaned: users paste them with or without slash)
+        if isinstance(api_url, EndpointPool):
+            self.endpoints = api_url
+        else:
+            self.endpoints = EndpointPool(api_url, strategy=routing, session=self.session,
+                                          headers=self.headers, model=model,
+                                          failure_threshold=breaker_threshold, cooldown=breaker_cooldown)
+        self.api_url = self.endpoints.endpoints[0].chat_url
         
         # Memory Initialization
         self.system_prompt_content = system_prompt
         self.history = [] 
         
-        # INCREASED LIMIT: 50 turns (User + AI) is safe for Qwen 14B on T4 GPU
-        self.max_history = 50 
+        # TOKEN BUDGET: the prompt may use the context window minus room for the reply.
+        # 4096 tokens is safe for Qwen 14B on T4 GPU.
+        self.context_tokens = context_tokens
+        self.reply_tokens = reply_tokens
+        self.trim_target = trim_target
+        self.keep_alive = keep_alive
+        # Cached token count of each message in history (same order), and their sum
+        self._token_counts = []
+        self._history_tokens = 0
         
-        # Set initial system prompt
-        self._reset_history()
+        # Leading messages the sliding window never drops (System Prompt, plus the summary once we have one)
+        self._pinned = 1
+        
+        # BACKGROUND COMPRESSION: a worker thread folds old turns into a rolling summary.
+        # All history rewrites happen under this lock so a chat() never sees a half-rewritten history.
+        self.auto_compress_tokens = auto_compress_tokens
+        self.keep_recent_tokens = keep_recent_tokens if keep_recent_tokens is not None else (auto_compress_tokens or 0) // 2
+        self.summary = None
+        self._lock = threading.RLock()
+        self._memory_epoch = 0 # bumped whenever history is replaced, so stale summaries are discarded
+        self._compressing = False
+        
+        # LONG-TERM MEMORY: evicted turns, searchable by meaning
+        self.memory = memory
+        
+        # Response cache (only used for deterministic, low-temperature calls)
+        self.cache = cache
+        self.cache_max_temperature = cache_max_temperature
+        
+        # MODEL CASCADE: small model first, `model` only when needed
+        self.cascade = cascade
+        
+        # Structured output counters (see chat_json / malformed_rate)
+        self.json_stats = {"calls": 0, "malformed": 0}
+        self.last_json_errors = []
+        
+        # TIMEOUTS: fixed, or derived from the latencies seen so far (see _read_timeout)
+        self.timeout = timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_factor = timeout_factor
+        self._timeout_scale = 1 # doubles after every timeout, so a server that got slower isn't cut off forever
+        self._latencies = {} # (model, stream) -> Histogram of seconds until the server answered
+        self._latency_lock = threading.Lock()
+        
+        # HEDGED REQUESTS: the duplicate runs in its own thread
+        self.hedge = hedge
+        self._hedge_pool = ThreadPoolExecutor(max_workers=2 * pool_size) if hedge else None
+        
+        # Outcome of the last warm_up() (None until one finished)
+        self.last_warm_up = None
+        
+        # Timing of the most recent call (seconds). ttft = time to first token.
+        self.last_stats = {"ttft": None, "total": None}
+        # Full latency breakdown of the most recent call, and the running totals
+        self.last_metrics = None
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        
+        # PERSISTENCE: the store holds the whole conversation, RAM only the active window
+        self.store = store
+        self.session_id = None
+        
+        # Set initial system prompt (or resume the stored conversation)
+        if store is not None:
+            self.open_session(session_id or uuid.uuid4().hex)
+        else:
+            self._reset_history()
 
     def _reset_history(self):
         """Internal helper to rebuild memory with current system prompt."""
-        self.history = [{"role": "system", "content": self.system_prompt_content}]
+        with self._lock:
+            self.history = [{"role": "system", "content": self.system_prompt_content}]
+            self.summary = None
+            self._pinned = 1
+            self._memory_epoch += 1
+            self._recount_tokens()
+            if self.store is not None:
+                self.store.reset(self.session_id, self.system_prompt_content)
+            if self.memory is not None:
+                self.memory.clear()
+
+    def _recount_tokens(self):
+        """Internal helper: rebuilds the cached token counts after history was replaced."""
+        self._token_counts = [estimate_tokens(m["content"]) for m in self.history]
+        self._history_tokens = sum(self._token_counts)
+
+    def _remember(self, role, content):
+        """Internal helper: appends a message to memory, counting its tokens once."""
+        with self._lock:
+            if len(self._token_counts) != len(self.history):
+                self._recount_tokens() # history was edited from outside, resync
+            tokens = estimate_tokens(content)
+            self.history.append({"role": role, "content": content})
+            self._token_counts.append(tokens)
+            self._history_tokens += tokens
+            if self.store is not None:
+                self.store.append(self.session_id, role, content, tokens)
+
+    def _forget(self):
+        """Internal helper: removes the newest message from memory."""
+        with self._lock: # history and _token_counts may be swapped by the background summary meanwhile
+            self.history.pop()
+            self._history_tokens -= self._token_counts.pop()
+            if self.store is not None:
+                self.store.pop(self.session_id)
+
+    def _trim_to_budget(self):
+        """
+        Sliding Window (Garbage Collection).
+        Once the prompt no longer fits the token budget, drops the oldest turns down to
+        trim_target of the budget, but KEEPS the pinned messages (System Prompt, summary)
+        and the newest message. Each message is only ever looked at once when it is evicted,
+        so trimming is O(1) amortized per turn.
+        
+        Why in one big chunk? Ollama reuses its cache for the part of the prompt that is unchanged
+        since the last request. Dropping one turn every time would change the prompt right after the
+        system prompt, forcing the server to re-read the whole history on every turn.
+        Dropping many turns at once changes the prefix only occasionally.
+        """
+        budget = self._window_budget()
+        if self._history_tokens <= budget:
+            return
+        excess = self._history_tokens - int(budget * self.trim_target)
+
+        first = self._pinned
+        cut, freed = first, 0
+        newest = len(self.history) - 1
+        while freed < excess and cut < newest:
+            freed += self._token_counts[cut]
+            cut += 1
+        # Drop whole turns: never leave an AI reply at the start of the window
+        while cut < newest and self.history[cut]["role"] == "assistant":
+            freed += self._token_counts[cut]
+            cut += 1
+
+        if self.memory is not None:
+            self.memory.evict(self.history[first:cut])
+        del self.history[first:cut]
+        del self._token_counts[first:cut]
+        self._history_tokens -= freed
+
+    def _window_budget(self):
+        """Internal helper: tokens the history may use (room is kept for the reply and recalled snippets)."""
+        budget = self.context_tokens - self.reply_tokens
+        if self.memory is not None:
+            budget -= self.memory.budget_tokens
+        return budget
+
+    def _prepare_turn(self, user_input, temperature, stream, format=None, recalled=None, instruction=None):
+        """
+        Internal helper: adds the user turn to memory and builds the request payload.
+        :param recalled: Optional message of recalled snippets, sent just before the new user turn (not stored).
+        :param instruction: Optional instruction text, sent just after the new user turn (not stored).
+        """
+        with self._lock:
+            # 1. Update Local Memory
+            self._remember("user", user_input)
+            
+            # 2. Sliding Window (Garbage Collection)
+            self._trim_to_budget()
+            
+            # Snapshot, so a background summary swapping history can't change an in-flight request
+            messages = list(self.history)
+        if recalled is not None:
+            # Right before the new turn, so everything before it stays an unchanged (cached) prefix
+            messages.insert(len(messages) - 1, recalled)
+        if instruction is not None:
+            messages.append({"role": "system", "content": instruction})
+
+        # 3. Build Payload
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": stream,
+            "options": {"temperature": temperature, "num_ctx": self.context_tokens},
+            "keep_alive": self.keep_alive # keep the model (and its prompt cache) resident between turns
+        }
+        if format is not None:
+            payload["format"] = format # "json" or a JSON schema (Ollama constrains the output to it)
+        return payload
+
+    def _finish_turn(self, ai_msg):
+        """Internal helper: stores the AI reply, then starts background compression if memory got too big."""
+        self._remember("assistant", ai_msg)
+        folded = self._claim_turns_to_fold()
+        if folded:
+            threading.Thread(target=self._background_compress, args=folded, daemon=True).start()
+        if self.memory is not None:
+            evicted = self.memory.claim_pending()
+            if evicted:
+                threading.Thread(target=self._archive_evicted, args=evicted, daemon=True).start()
+
+    def _cache_lookup(self, payload, temperature):
+        """
+        Internal helper: returns (cache_key, cached_reply).
+        cache_key is None when the cache is off or bypassed for this temperature.
+        """
+        if self.cache is None or temperature > self.cache_max_temperature:
+            return None, None
+        key = self.cache.make_key(payload)
+        return key, self.cache.get(key)
 
-    def chat(self, user_input, temperature=0.7):
+    def _observe_latency(self, payload, stream, seconds):
+        """Internal helper: records how long the server took to answer one kind of request (model, streamed)."""
+        with self._latency_lock:
+            key = (payload.get("model"), stream)
+            if key not in self._latencies:
+                self._latencies[key] = Histogram()
+            self._latencies[key].observe(seconds)
+
+    def _latency_percentile(self, payload, stream, q):
+        """Internal helper: q (0..1) of the answer time of this kind of request, None until enough were seen."""
+        with self._latency_lock:
+            histogram = self._latencies.get((payload.get("model"), stream))
+            if histogram is None or len(histogram.recent) < MIN_LATENCY_SAMPLES:
+                return None
+            return histogram.percentile(q)
+
+    def _read_timeout(self, payload, stream):
+        """
+        Internal helper: seconds to wait for the server's answer.
+        Streamed calls answer with their first token, so they go by the time to the first token,
+        other calls by the full request time, each for this model only. Until enough calls were seen,
+        max_timeout applies.
+        """
+        if self.timeout is not None:
+            return self.timeout
+        p99 = self._latency_percentile(payload, stream, 0.99)
+        if p99 is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, self.timeout_factor * p99) * self._timeout_scale)
+
+    def _network_error(self, e):
+        """Internal helper: the SovereignError for a failed connection (requests exception)."""
+        if isinstance(e, requests.exceptions.Timeout) and not isinstance(e, requests.exceptions.ConnectTimeout):
+            return self._timeout_error(e)
+        return ServerUnreachable(f"Cannot reach the server. Is Colab running and the URL correct? ({e})")
+
+    def _timeout_error(self, e):
+        """Internal helper: RequestTimeout for e, and the next timeouts get longer until a call succeeds."""
+        self._timeout_scale = min(self._timeout_scale * 2, 8)
+        detail = f" ({e})" if str(e) else ""
+        return RequestTimeout(f"No answer from the server in time{detail}")
+
+    @staticmethod
+    def _is_shed(status, headers):
+        """Internal helper: did the priority gateway turn the request away (503 + Retry-After)? Not a server fault."""
+        return status == 503 and "Retry-After" in headers
+
+    @staticmethod
+    def _status_error(status, headers, body):
+        """Internal helper: the SovereignError for an HTTP error answer (status >= 400)."""
+        if SovereignClient._is_shed(status, headers):
+            try:
+                retry_after = float(headers["Retry-After"])
+            except ValueError:
+                retry_after = None # an HTTP date: no delay we can use
+            return ServerBusy(f"Server busy, request shed by the gateway (retry after {headers['Retry-After']}s)",
+                              retry_after=retry_after)
+        if NGROK_ERROR_HEADER in headers:
+            return ServerUnreachable(f"The tunnel is up but Colab isn't answering "
+                                     f"({headers[NGROK_ERROR_HEADER]}). Is the server cell still running?")
+        try:
+            message = json.loads(body).get("error") or body
+        except (ValueError, AttributeError):
+            message = body
+        return ServerError(f"Server answered {status}: {str(message).strip()[:200]}", status=status)
+
+    def _check_circuit(self):
+        """Internal helper: fails at once (CircuitOpen) while every server is cooling down after failures."""
+        retry_in = self.endpoints.retry_in()
+        if retry_in > 0:
+            raise CircuitOpen(f"Server unreachable (failed {self.endpoints.failure_threshold}+ times in a row), "
+                              f"next try in {retry_in:.0f}s", retry_in)
+
+    def _open(self, payload, stream=False, candidates=None, timeout=None, blame=True):
+        """
+        Internal helper: POSTs to the best endpoint, failing over to the next one when a server
+        can't be reached or answers with a server error. Returns (response, endpoint).
+        :param candidates: Endpoints to try, in order (default: the pool's choice).
+        :param timeout: Fixed seconds to wait for this answer (default: adaptive). A request with its own
+                        timeout (model load, summaries) doesn't feed the adaptive one either.
+        :param blame: False = a failure doesn't count toward the circuit breaker (e.g. a warm-up).
+        """
+        self._check_circuit()
+        candidates = candidates or self.endpoints.candidates()
+        read_timeout = timeout if timeout is not None else self._read_timeout(payload, stream)
+        last_error = None
+        for i, endpoint in enumerate(candidates):
+            self.endpoints.begin(endpoint)
+            start = time.perf_counter()
+            try:
+                response = self.session.post(endpoint.chat_url, json=payload, headers=self.headers,
+                                             timeout=(CONNECT_TIMEOUT, read_timeout), stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.endpoints.report(endpoint, ok=False if blame else None)
+                last_error = e
+                continue
+            # A shed request isn't a dead server: it is raised as ServerBusy, with no verdict on the endpoint
+            down = ((response.status_code >= 500 and not self._is_shed(response.status_code, response.headers))
+                    or NGROK_ERROR_HEADER in response.headers)
+            if down and i < len(candidates) - 1:
+                response.close()
+                self.endpoints.report(endpoint, ok=False if blame else None)
+                continue
+            if timeout is None and response.status_code < 400:
+                # Streamed: the headers come with the first token. Otherwise: with the whole answer
+                self._observe_latency(payload, stream, time.perf_counter() - start)
+            return response, endpoint
+        raise self._network_error(last_error) from last_error
+
+    @contextmanager
+    def _request(self, payload, stream=False, candidates=None, timeout=None, blame=True):
+        """
+        Internal helper: one request through the endpoint pool, as a context manager.
+        HTTP errors and failures while reading the body are raised as SovereignErrors.
+        The endpoint is credited (or blamed) once the body has been read. timeout / blame: see _open.
+        """
+        response, endpoint = self._open(payload, stream=stream, candidates=candidates, timeout=timeout, blame=blame)
+        ok = False
+        try:
+            with response:
+                if response.status_code >= 400:
+                    raise self._status_error(response.status_code, response.headers, response.text)
+                try:
+                    yield response
+                except GeneratorExit:
+                    ok = None # the caller stopped reading a stream early: no verdict on the server
+                    raise
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError) as e:
+                    raise self._network_error(e) from e
+                except ValueError as e:
+                    raise ServerError(f"Malformed answer from the server: {e}") from e
+            ok = True
+            self._timeout_scale = 1
+        except ServerBusy:
+            ok = None # shed by the priority gateway: the server is healthy, just full
+            raise
+        except ServerError as e:
+            # A rejected request (bad model name...) says nothing about the server's health
+            ok = e.status is not None and e.status < 500
+            raise
+        finally:
+            self.endpoints.report(endpoint, ok if blame else None)
+
+    def _fetch(self, payload, candidates=None, timeout=None, blame=True):
+        """Internal helper: one non-streamed request. Returns (data, queue_wait). timeout / blame: see _open."""
+        with self._request(payload, candidates=candidates, timeout=timeout, blame=blame) as response:
+            return response.json(), queue_wait_from(response.headers)
+
+    def _hedge_delay(self, payload):
+        """Internal helper: seconds after which this request gets a duplicate (None = don't hedge)."""
+        if not self.hedge:
+            return None
+        return self._latency_percentile(payload, False, 0.95)
+
+    def _post(self, payload):
+        """
+        Internal helper: one non-streamed request, returns (data, queue_wait).
+        HEDGING: if the answer takes longer than the p95 latency, the same request is sent again
+        (to the next server when there are several) and whichever answers first is used.
+        The slower copy runs to completion in the background, its answer is dropped.
+        """
+        delay = self._hedge_delay(payload)
+        if delay is None:
+            return self._fetch(payload)
+        candidates = self.endpoints.candidates()
+        first = self._hedge_pool.submit(self._fetch, payload, candidates)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        second = self._hedge_pool.submit(self._fetch, payload, candidates[1:] + candidates[:1])
+        self.telemetry.record_hedge()
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self.telemetry.record_hedge(won=True)
+                    return future.result()
+        return first.result() # both failed: raise the original request's error
+
+    def _cascade_rule(self, payload, prompt_tokens):
+        """Internal helper (cascade): the CascadeRule if this request goes to the small model first, else None."""
+        if self.cascade is None:
+            return None
+        messages = payload["messages"]
+        rule = self.cascade.rule_for(messages[0]["content"] if messages[0]["role"] == "system" else "")
+        return rule if self.cascade.should_try(rule, prompt_tokens) else None
+
+    def _try_small_model(self, payload, rule):
+        """
+        Internal helper (cascade): sends the request to the cascade's small model first (rule: see _cascade_rule).
+        Returns (data, queue_wait) if its reply is good enough, None if `model` has to answer.
+        Never raises: a failing small model is escalated like a bad reply.
+        """
+        if rule is None:
+            return None
+        start = time.perf_counter()
+        try:
+            data, queue_wait = self._post(self.cascade.small_payload(payload, rule))
+            reason = self.cascade.judge(rule, data, payload.get("format"))
+        except SovereignError:
+            reason = "small model failed"
+        self.cascade.record_small(time.perf_counter() - start, reason)
+        return (data, queue_wait) if reason is None else None
+
+    def _post_large(self, payload):
+        """Internal helper (cascade): _post to `model`, timed for the cascade's latency saved estimate."""
+        start = time.perf_counter()
+        answer = self._post(payload)
+        if self.cascade is not None:
+            self.cascade.record_large(time.perf_counter() - start)
+        return answer
+
+    @staticmethod
+    def _chunks(response):
+        """Internal helper: Ollama streams NDJSON, one JSON object per line (the last one has "done": true)."""
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise ServerError(chunk["error"])
+            yield chunk
+
+    def _stream_chunks(self, payload, prompt_tokens):
+        """
+        Internal helper: streams one turn's reply, yields (chunk, queue_wait) for each NDJSON chunk.
+        With a cascade the small model streams first. Its reply is held back until it is rule.hold_chars long
+        (or done) and judged so far: if it is escalated nothing of it was yielded and `model` streams instead,
+        otherwise the held text comes as one chunk, the rest as it is generated, and the reply is kept.
+        JSON replies can only be judged whole: the small model answers in one go (a kept one is a single chunk).
+        """
+        rule = self._cascade_rule(payload, prompt_tokens)
+        if rule is not None and payload.get("format") is not None:
+            answer = self._try_small_model(payload, rule)
+            if answer is not None:
+                yield answer
+                return
+        elif rule is not None:
+            start = time.perf_counter()
+            kept = False
+            reason = "small model failed" # unless it is judged below
+            try:
+                small = self.cascade.small_payload(payload, rule, stream=True)
+                with self._request(small, stream=True) as response:
+                    queue_wait = queue_wait_from(response.headers)
+                    held = ""
+                    for chunk in self._chunks(response):
+                        if not kept:
+                            held += chunk.get("message", {}).get("content", "")
+                            done = chunk.get("done")
+                            if not done and len(held) < rule.hold_chars:
+                                continue
+                            chunk = dict(chunk, message={"role": "assistant", "content": held})
+                            reason = self.cascade.judge(rule, chunk, partial=not done)
+                            if reason is not None:
+                                break
+                            kept = True
+                        yield chunk, queue_wait
+                        if chunk.get("done"):
+                            break
+            except SovereignError:
+                if kept:
+                    raise # already shown: it fails like any streamed turn
+            self.cascade.record_small(time.perf_counter() - start, None if kept else reason)
+            if kept:
+                return
+
+        start = time.perf_counter()
+        with self._request(payload, stream=True) as response:
+            queue_wait = queue_wait_from(response.headers)
+            for chunk in self._chunks(response):
+                yield chunk, queue_wait
+                if chunk.get("done"):
+                    break
+        if self.cascade is not None:
+            self.cascade.record_large(time.perf_counter() - start)
+
+    def _rollback_turn(self, payload):
+        """Internal helper: takes a failed turn's user message back out of memory."""
+        with self._lock:
+            # Unless the history moved on meanwhile (e.g. it was wiped). The turn is the last user message sent
+            turn = next(m for m in reversed(payload["messages"]) if m["role"] == "user")
+            if len(self.history) > self._pinned and self.history[-1] is turn:
+                self._forget()
+
+    def _record_metrics(self, data, ttft, queue_wait=None):
+        """
+        Internal helper: turns the server's timing fields + client time into TurnMetrics and records them.
+        :param ttft: Time to first token, only known for streamed calls (None otherwise).
+        :param queue_wait: Seconds the server's priority gateway queued the request (None = no gateway).
+        """
+        self.last_metrics = TurnMetrics(self.last_stats["total"], ttft=ttft, data=data, model=self.model,
+                                        queue_wait=queue_wait)
+        self.telemetry.record(self.last_metrics)
+
+    def chat(self, user_input, temperature=0.7, on_token=None, format=None, instruction=None):
         """
         Send message to server and get response.
         :param temperature: 0.1 = Robotic/Precise, 0.9 = Creative/Random
+        :param on_token: Optional callback. If given, the reply is streamed and
+                         on_token(text) is called for every chunk as it arrives.
+        :param format: Optional Ollama output format: "json" or a JSON schema dict.
+        :param instruction: Optional one-off instruction for this reply only, sent after user_input but
+                            never stored (history and the store keep just what the user said).
+        Raises a SovereignError if the turn failed (the user message is then not kept in memory).
         """
-        # 1. Update Local Memory
-        self.history.append({"role": "user", "content": user_input})
+        if on_token is not None:
+            pieces = []
+            stream = self.chat_stream(user_input, temperature=temperature, format=format, instruction=instruction)
+            try:
+                for token in stream:
+                    on_token(token)
+                    pieces.append(token)
+            finally:
+                stream.close() # if on_token raised (Ctrl+C...), the turn is rolled back right away
+            return "".join(pieces)
+
+        payload = self._prepare_turn(user_input, temperature, stream=False, format=format,
+                                     recalled=self._recall(user_input), instruction=instruction)
+        start = time.perf_counter()
+
+        # Answered before? (deterministic calls only)
+        cache_key, cached = self._cache_lookup(payload, temperature)
+        if cached is not None:
+            total = time.perf_counter() - start
+            self.last_stats = {"ttft": total, "total": total}
+            self._finish_turn(cached)
+            return cached
+
+        # 4. Transmit (with a cascade: to the small model first)
+        try:
+            rule = self._cascade_rule(payload, self._history_tokens)
+            data, queue_wait = self._try_small_model(payload, rule) or self._post_large(payload)
+        except SovereignError:
+            # Failed turn: roll it back, so memory doesn't hold a question that was never answered
+            self.telemetry.record_error()
+            self._rollback_turn(payload)
+            raise
+        except BaseException:
+            # Interrupted (Ctrl+C...): the unanswered turn isn't kept either
+            self._rollback_turn(payload)
+            raise
+        
+        # 5. Process Response
+        ai_msg = data['message']['content']
         
-        # 2. Sliding Window (Garbage Collection)
-        # If history exceeds limit, remove oldest messages (but KEEP index 0 which is System Prompt)
-        # We check > max_history + 1 because history[0] is the system prompt
-        if len(self.history) > self.max_history + 1:
-            self.history.pop(1) # Remove oldest User message
-            self.history.pop(1) # Remove oldest AI message
+        # Without streaming the first token arrives with the last one
+        total = time.perf_counter() - start
+        self.last_stats = {"ttft": total, "total": total}
+        self._record_metrics(data, ttft=None, queue_wait=queue_wait)
+        
+        if cache_key is not None:
+            self.cache.put(cache_key, ai_msg)
+        
+        # Add AI response to memory
+        self._finish_turn(ai_msg)
+        return ai_msg
 
-        # 3. Build Payload
+    def chat_stream(self, user_input, temperature=0.7, format=None, instruction=None):
+        """
+        Streaming version of chat(). Yields text chunks as Ollama generates them.
+        The full reply is stored in memory once the stream finishes.
+        Raises a SovereignError if the turn failed, even midway (the user message is then not kept in memory).
+        
+        Usage:
+            for token in bot.chat_stream("Hello"):
+                print(token, end="", flush=True)
+        """
+        payload = self._prepare_turn(user_input, temperature, stream=True, format=format,
+                                     recalled=self._recall(user_input), instruction=instruction)
+        start = time.perf_counter()
+        self.last_stats = {"ttft": None, "total": None}
+        pieces = []
+        final = {}
+        queue_wait = None
+
+        # A cached reply arrives as one single chunk
+        cache_key, cached = self._cache_lookup(payload, temperature)
+        if cached is not None:
+            total = time.perf_counter() - start
+            self.last_stats = {"ttft": total, "total": total}
+            self._finish_turn(cached)
+            yield cached
+            return
+
+        # Transmit (with a cascade: the small model streams first, see _stream_chunks)
+        chunks = self._stream_chunks(payload, self._history_tokens)
+        try:
+            for chunk, queue_wait in chunks:
+                token = chunk.get("message", {}).get("content", "")
+                if token:
+                    if self.last_stats["ttft"] is None:
+                        self.last_stats["ttft"] = time.perf_counter() - start
+                    pieces.append(token)
+                    yield token
+                
+                if chunk.get("done"):
+                    final = chunk # the last chunk carries Ollama's timing fields (the stream ends with it)
+
+        except SovereignError:
+            self.telemetry.record_error()
+            self._rollback_turn(payload)
+            raise
+        except BaseException:
+            # Abandoned mid-reply (the caller stopped reading, Ctrl+C...): the unanswered turn isn't kept either
+            self._rollback_turn(payload)
+            raise
+        finally:
+            chunks.close()
+
+        self.last_stats["total"] = time.perf_counter() - start
+        self._record_metrics(final, ttft=self.last_stats["ttft"], queue_wait=queue_wait)
+        ai_msg = "".join(pieces)
+        if cache_key is not None:
+            self.cache.put(cache_key, ai_msg)
+        
+        # Add the assembled AI response to memory
+        self._finish_turn(ai_msg)
+
+    def chat_json(self, user_input, schema=None, temperature=0.1, on_field=None):
+        """
+        Structured output: the server is constrained to reply with JSON (matching schema, if given).
+        Returns the parsed object, or None if the reply was malformed (reasons in last_json_errors).
+        Raises a SovereignError if the request itself failed.
+        :param schema: Optional JSON schema dict, e.g. {"type": "object", "properties": {...}, "required": [...]}
+        :param on_field: Optional callback on_field(key, value). The reply is streamed and each top-level
+                         field is handed over as soon as it is complete, before the rest is generated.
+        """
+        format = schema if schema is not None else "json"
+        if on_field is None:
+            text = self.chat(user_input, temperature=temperature, format=format)
+        else:
+            parser = IncrementalJSONParser()
+            pieces = []
+            for token in self.chat_stream(user_input, temperature=temperature, format=format):
+                pieces.append(token)
+                for key, value in parser.feed(token):
+                    on_field(key, value)
+            text = "".join(pieces)
+        return self._parse_json_reply(text, schema)
+
+    def _parse_json_reply(self, text, schema):
+        """Internal helper: parses + validates a chat_json reply and updates the malformed-output counters."""
+        self.json_stats["calls"] += 1
+        try:
+            result = json.loads(strip_fences(text))
+            self.last_json_errors = validate(result, schema) if schema is not None else []
+        except ValueError as e:
+            result = None
+            self.last_json_errors = [f"not valid JSON: {e}"]
+
+        if self.last_json_errors:
+            self.json_stats["malformed"] += 1
+            return None
+        return result
+
+    @property
+    def malformed_rate(self):
+        """Share of chat_json replies that were not valid JSON or broke the schema."""
+        calls = self.json_stats["calls"]
+        return self.json_stats["malformed"] / calls if calls else 0.0
+
+    # ==========================================================================
+    #                              BATCH MODE
+    # ==========================================================================
+    def _batch_messages(self, item):
+        """
+        Internal helper: the message list for one batch item.
+        An item is a prompt string, or a dict with "prompt" or "messages" (optionally "id" and "temperature").
+        The current persona is used as system prompt unless the item brings its own.
+        """
+        if isinstance(item, str):
+            messages = [{"role": "user", "content": item}]
+        elif "messages" in item:
+            messages = list(item["messages"])
+        else:
+            messages = [{"role": "user", "content": item["prompt"]}]
+        if not messages or messages[0]["role"] != "system":
+            messages.insert(0, {"role": "system", "content": self.system_prompt_content})
+        return messages
+
+    def _complete(self, messages, temperature, format=None):
+        """
+        Internal helper: one stateless request (memory is not touched). Raises a SovereignError on failure.
+        Used by batch mode, so it is safe to call from many threads at once.
+        """
         payload = {
             "model": self.model,
-            "messages": self.history,
+            "messages": messages,
             "stream": False,
-            "options": {"temperature": temperature}
+            "options": {"temperature": temperature, "num_ctx": self.context_tokens},
+            "keep_alive": self.keep_alive
         }
+        if format is not None:
+            payload["format"] = format
+        cache_key, cached = self._cache_lookup(payload, temperature)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        rule = self._cascade_rule(payload, sum(estimate_tokens(m["content"]) for m in messages))
+        data, queue_wait = self._try_small_model(payload, rule) or self._post_large(payload)
+        self.telemetry.record(TurnMetrics(time.perf_counter() - start, data=data, model=self.model,
+                                          queue_wait=queue_wait))
+        ai_msg = data['message']['content']
+        if cache_key is not None:
+            self.cache.put(cache_key, ai_msg)
+        return ai_msg
+
+    def _run_batch_item(self, item_id, item, temperature, retries, format):
+        """Internal helper: runs one batch item with retries (1s, 2s, 4s... backoff)."""
+        messages = self._batch_messages(item)
+        if isinstance(item, dict):
+            temperature = item.get("temperature", temperature)
+        error = None
+        for attempt in range(1, retries + 2):
+            try:
+                reply = self._complete(messages, temperature, format=format)
+                return {"id": item_id, "reply": reply, "error": None, "attempts": attempt}
+            except Exception as e:
+                self.telemetry.record_error()
+                error = str(e)
+                if attempt <= retries:
+                    time.sleep(2 ** (attempt - 1))
+        return {"id": item_id, "reply": None, "error": error, "attempts": retries + 1}
+
+    @staticmethod
+    def _load_checkpoint(path):
+        """Internal helper: ids already completed successfully in an earlier run."""
+        done = set()
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # half-written last line of a crashed run
+                    if record.get("error") is None:
+                        done.add(record["id"])
+        return done
+
+    def chat_many(self, items, concurrency=4, temperature=0.7, retries=2, checkpoint=None, format=None):
+        """
+        BATCH MODE: runs many independent prompts/conversations with bounded concurrency.
+        Each item is answered on its own (memory is not used or changed).
+        Results are yielded as they finish (completion order, not input order) as dicts:
+            {"id": ..., "reply": "...", "error": None, "attempts": 1}
+        Only ~2x concurrency items are held at once, so huge (even endless) iterables are fine.
+        
+        :param items: Iterable of prompt strings, or dicts with "prompt" or "messages" (+ optional "id", "temperature").
+                      Without an "id", an item's position in the iterable is its id.
+        :param concurrency: Max requests in flight (create the client with pool_size >= concurrency
+                            so every request keeps its own keep-alive connection).
+        :param retries: Extra attempts per item before giving up (its result then has "error" set).
+        :param checkpoint: Optional JSONL file. Every result is appended to it, and items that
+                           already succeeded there are skipped: re-run the same job to resume it.
+        
+        Usage:
+            for result in bot.chat_many(questions, concurrency=8, checkpoint="grading.jsonl"):
+                print(result["id"], result["reply"])
+        """
+        done_ids = self._load_checkpoint(checkpoint)
+        log = open(checkpoint, "a") if checkpoint is not None else None
+        source = iter(enumerate(items))
+        pending = set()
+
+        def submit_next():
+            for index, item in source:
+                item_id = item.get("id", index) if isinstance(item, dict) else index
+                if item_id in done_ids:
+                    continue
+                pending.add(pool.submit(self._run_batch_item, item_id, item, temperature, retries, format))
+                return True
+            return False
+
+        pool = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            # Keep the workers busy, with one spare item each queued behind them
+            for _ in range(concurrency * 2):
+                if not submit_next():
+                    break
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pending.remove(future)
+                    result = future.result()
+                    if log is not None:
+                        log.write(json.dumps(result) + "\n")
+                        log.flush()
+                    submit_next()
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+            if log is not None:
+                log.close()
 
-        # 4. Transmit
+    # ==========================================================================
+    #                           HEALTH AND WARM-UP
+    # ==========================================================================
+    def _probe(self, endpoint, timeout):
+        """Internal helper: health of one endpoint (two metadata requests, no generation)."""
+        result = {"url": endpoint.base_url, "reachable": False, "model_available": False,
+                  "model_loaded": False, "latency": None, "error": None}
         try:
-            response = requests.post(self.api_url, json=payload, headers=self.headers, timeout=120)
+            start = time.perf_counter()
+            for path, field in (("/api/tags", "model_available"), ("/api/ps", "model_loaded")):
+                response = self.session.get(endpoint.base_url + path, headers=self.headers, timeout=timeout)
+                with response:
+                    if response.status_code >= 400:
+                        raise self._status_error(response.status_code, response.headers, response.text)
+                    result[field] = has_model(response.json().get("models", []), self.model)
+                if result["latency"] is None:
+                    result["latency"] = time.perf_counter() - start
+                    result["reachable"] = True
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            result["error"] = str(self._network_error(e))
+        except (SovereignError, ValueError) as e:
+            result["error"] = str(e)
+        return result
+
+    def health(self, timeout=5):
+        """
+        Cheap readiness probe: asks every server for its model list (/api/tags) and the models
+        loaded in VRAM (/api/ps). Takes milliseconds and no GPU time, unlike a test chat.
+        :return: {"reachable", "ready" (model available), "loaded" (model in VRAM): True if any server is,
+                  "endpoints": [{"url", "reachable", "model_available", "model_loaded", "latency", "error"}]}
+        """
+        endpoints = [self._probe(endpoint, timeout) for endpoint in self.endpoints.endpoints]
+        return {
+            "reachable": any(e["reachable"] for e in endpoints),
+            "ready": any(e["model_available"] for e in endpoints),
+            "loaded": any(e["model_loaded"] for e in endpoints),
+            "endpoints": endpoints,
+        }
+
+    def _warm_up_payloads(self):
+        """
+        Internal helper: chat requests without messages only load a model (and restart its keep_alive).
+        One for `model`, and one for the cascade's small model if there is a cascade.
+        """
+        models = [self.model] + ([self.cascade.small_model] if self.cascade is not None else [])
+        return [{"model": model, "messages": [], "keep_alive": self.keep_alive} for model in models]
+
+    def warm_up(self, wait=False):
+        """
+        Preloads the model into VRAM on every server, in a background thread, so the first real turn
+        doesn't pay the model load. Nothing is generated and memory is not touched.
+        The outcome ends up in last_warm_up: {"seconds", "error"} (None while it is still running).
+        :param wait: True = block until the model is loaded.
+        :return: The background thread.
+        """
+        self.last_warm_up = None
+
+        def load(endpoint):
+            try:
+                for payload in self._warm_up_payloads():
+                    # A cold load can take minutes, and a server that can't load isn't a server that's down
+                    self._fetch(payload, candidates=[endpoint], timeout=self.max_timeout, blame=False)
+            except SovereignError as e:
+                return str(e)
+
+        def run():
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=len(self.endpoints)) as pool:
+                errors = [error for error in pool.map(load, self.endpoints.endpoints) if error]
+            self.last_warm_up = {"seconds": time.perf_counter() - start, "error": errors[0] if errors else None}
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return thread
+
+    # ==========================================================================
+    #                       LONG-TERM (RETRIEVAL) MEMORY
+    # ==========================================================================
+    def _embed(self, texts):
+        """Internal helper: embeddings of several texts in one request (Ollama /api/embed)."""
+        endpoint = self.endpoints.candidates()[0]
+        payload = {"model": self.memory.embed_model, "input": texts, "keep_alive": self.keep_alive}
+        response = self.session.post(endpoint.base_url + "/api/embed", json=payload, headers=self.headers,
+                                     timeout=(CONNECT_TIMEOUT, 60))
+        with response:
             response.raise_for_status()
-            
-            # 5. Process Response
-            data = response.json()
-            ai_msg = data['message']['content']
-            
-            # Add AI response to memory
-            self.history.append({"role": "assistant", "content": ai_msg})
-            return ai_msg
+            return response.json()["embeddings"]
 
-        except requests.exceptions.ConnectionError:
-            return "❌ NETWORK ERROR: Cannot reach Colab. Is the URL correct?"
+    def _recall(self, user_input):
+        """Internal helper: message of old turns relevant to user_input, or None. Best effort: never fails a turn."""
+        if self.memory is None or len(self.memory) == 0 or self.endpoints.retry_in() > 0:
+            return None
+        try:
+            return self.memory.recall(self._embed([user_input])[0])
         except Exception as e:
-            return f"❌ SYSTEM ERROR: {e}"
+            print(f"⚠️ Recall skipped: {e}")
+            return None
+
+    def _archive_evicted(self, generation, snippets):
+        """Worker thread: embeds turns that left the window (in batches) and adds them to the index."""
+        try:
+            for batch in self.memory.batches(snippets):
+                self.memory.store(generation, batch, self._embed(batch))
+        except Exception as e:
+            print(f"❌ Archiving to long-term memory failed: {e}")
+        finally:
+            self.memory.done_archiving()
 
     def set_persona(self, new_prompt):
         """Clears memory and applies a new personality."""
@@ -98,12 +1106,79 @@ class SovereignClient:
 
     def forget_last(self):
         """Undoes the last turn (Removes 1 User msg + 1 AI msg)."""
-        if len(self.history) > 1:
-            self.history.pop() # Pop AI response
-            self.history.pop() # Pop User prompt
-            print("Action Undone. Memory rolled back.")
-        else:
-            print("Nothing to forget.")
+        with self._lock: # not while a background summary is being swapped in
+            forgotten = len(self.history) > self._pinned + 1
+            if forgotten:
+                self._forget() # Pop AI response
+                self._forget() # Pop User prompt
+        print("Action Undone. Memory rolled back." if forgotten else "Nothing to forget.")
+
+    def fork(self, telemetry=None):
+        """
+        Independent copy of the conversation so far, that can chat on its own (e.g. in a background thread)
+        without touching this one. Shares the connection pool, servers and response cache.
+        It has no store, long-term memory or auto-compression: nothing it says is kept anywhere.
+        :param telemetry: Where the fork records its calls (default: shared with this client).
+        """
+        with self._lock:
+            clone = copy.copy(self)
+            clone.history = list(self.history)
+            clone._token_counts = list(self._token_counts)
+        clone._lock = threading.RLock()
+        clone._compressing = False
+        clone.store = None
+        clone.memory = None
+        clone.auto_compress_tokens = None
+        clone.json_stats = dict(self.json_stats)
+        clone.last_json_errors = []
+        clone.last_stats = {"ttft": None, "total": None}
+        clone.last_metrics = None
+        if telemetry is not None:
+            clone.telemetry = telemetry
+        return clone
+
+    def extend_last_reply(self, text):
+        """Appends text to the newest AI reply in memory (used to splice prefetched text into the conversation)."""
+        with self._lock:
+            if len(self.history) <= self._pinned or self.history[-1]["role"] != "assistant":
+                raise ValueError("The conversation doesn't end with an AI reply")
+            content = self.history[-1]["content"] + text
+            self._forget()
+            self._remember("assistant", content)
+
+    def open_session(self, session_id, system_prompt=None):
+        """
+        Switches to a conversation in the store. If it exists it is resumed: only the newest messages
+        that fit the context window are read back (fast even for huge archives).
+        Otherwise it is started fresh.
+        :param system_prompt: Persona for the session (default: the stored one, or the current one for a new session).
+                              A different persona than the stored one starts the session over, like set_persona.
+        :return: How many messages were resumed.
+        """
+        if self.store is None:
+            raise ValueError("open_session needs a conversation store (store=...)")
+        budget = int(self._window_budget() * self.trim_target)
+        state = self.store.load(session_id, budget)
+        with self._lock:
+            self.session_id = session_id
+            if state is None or (system_prompt is not None and system_prompt != state["system_prompt"]):
+                if system_prompt is not None:
+                    self.system_prompt_content = system_prompt
+                self._reset_history()
+                return 0
+
+            if self.memory is not None:
+                self.memory.clear() # long-term memory belongs to the previous conversation
+            self.system_prompt_content = state["system_prompt"]
+            self.history = [{"role": "system", "content": self.system_prompt_content}]
+            self.summary = state["summary"]
+            if self.summary is not None:
+                self.history.append({"role": "assistant", "content": f"MEMORY CONTEXT: {self.summary}"})
+            self._pinned = len(self.history)
+            self.history += [{"role": m["role"], "content": m["content"]} for m in state["messages"]]
+            self._memory_epoch += 1
+            self._recount_tokens()
+            return len(state["messages"])
 
     def compress_memory(self):
         """
@@ -112,28 +1187,143 @@ class SovereignClient:
         Use this if you want to talk for hours.
         """
         print("🗜️ Compressing Memory...", end="\r")
+        payload = self._summary_payload()
         
-        # Create a temporary one-off request
+        try:
+            # We don't use self.chat() because we don't want this in the history
+            # (a whole-history summary is far slower than a turn: it gets the max timeout)
+            with self._request(payload, timeout=self.max_timeout) as response:
+                summary_text = response.json()['message']['content']
+            
+            self._apply_summary(summary_text)
+            print("✅ Memory Compressed. Space Reclaimed.")
+            return summary_text
+            
+        except Exception as e:
+            print(f"❌ Compression Failed: {e}")
+
+    def _summary_payload(self):
+        """Internal helper: builds the one-off summarization request used by compress_memory."""
         summary_request = self.history + [{"role": "user", "content": "Summarize our conversation so far in one detailed paragraph. Preserve key facts and code snippets."}]
-        
-        payload = {
+        return {
             "model": self.model,
             "messages": summary_request,
-            "stream": False
+            "stream": False,
+            "options": {"num_ctx": self.context_tokens},
+            "keep_alive": self.keep_alive
         }
-        
-        try:
-            # We don't use self.chat() because we don't want this in the history
-            response = requests.post(self.api_url, json=payload, headers=self.headers, timeout=120)
-            summary_text = response.json()['message']['content']
-            
-            # Rewrite History: System Prompt + Summary
+
+    def _apply_summary(self, summary_text):
+        """Internal helper: rewrites history as System Prompt + Summary."""
+        with self._lock:
+            if self.memory is not None:
+                self.memory.evict(self.history[self._pinned:])
             self.history = [
                 {"role": "system", "content": self.system_prompt_content},
                 {"role": "assistant", "content": f"MEMORY CONTEXT: {summary_text}"}
             ]
-            print("✅ Memory Compressed. Space Reclaimed.")
-            return summary_text
-            
+            self.summary = summary_text
+            self._pinned = 2
+            self._memory_epoch += 1
+            self._recount_tokens()
+            if self.store is not None:
+                self.store.set_summary(self.session_id, summary_text, keep=0)
+
+    # ==========================================================================
+    #                       BACKGROUND (AUTO) COMPRESSION
+    # ==========================================================================
+    def _claim_turns_to_fold(self):
+        """
+        Internal helper: if history is over auto_compress_tokens (and no summary is already running),
+        picks the oldest whole turns to fold into the summary, keeping keep_recent_tokens word-for-word.
+        Returns (epoch, turns) for the worker, or None.
+        """
+        with self._lock:
+            if not self.auto_compress_tokens or self._compressing:
+                return None
+            # Only the conversation counts: the system prompt and the summary itself are never folded
+            first = self._pinned
+            remaining = self._history_tokens - sum(self._token_counts[:first])
+            if remaining <= self.auto_compress_tokens:
+                return None
+
+            cut = first
+            last = len(self.history) - 1
+            while remaining > self.keep_recent_tokens and cut < last:
+                remaining -= self._token_counts[cut]
+                cut += 1
+            # Fold whole turns: the recent part must start with a user message
+            while cut < last and self.history[cut]["role"] != "user":
+                cut += 1
+            if self.history[cut]["role"] != "user":
+                # No user message left to start the recent part: keep at least the newest whole turn
+                cut -= 1
+                while cut > first and self.history[cut]["role"] != "user":
+                    cut -= 1
+            if cut <= first:
+                return None
+
+            self._compressing = True
+            return self._memory_epoch, self.history[first:cut]
+
+    def _incremental_summary_payload(self, turns):
+        """Internal helper: asks the AI to update the rolling summary with just the new turns (not the whole chat)."""
+        transcript = "\n".join(f"{m['role'].upper()}: {m['content']}" for m in turns)
+        previous = self.summary or "(nothing yet)"
+        prompt = (
+            f"Current summary of the conversation:\n{previous}\n\n"
+            f"New conversation lines:\n{transcript}\n\n"
+            "Rewrite the summary so it also covers the new lines, in one detailed paragraph. "
+            "Preserve key facts and code snippets. Reply with the summary only."
+        )
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": "You maintain a running summary of a conversation."},
+                {"role": "user", "content": prompt}
+            ],
+            "stream": False,
+            "options": {"num_ctx": self.context_tokens},
+            "keep_alive": self.keep_alive
+        }
+
+    def _background_compress(self, epoch, turns):
+        """Worker thread: summarizes the folded turns while the conversation carries on."""
+        try:
+            payload = self._incremental_summary_payload(turns)
+            with self._request(payload, timeout=self.max_timeout) as response:
+                summary_text = response.json()['message']['content']
+            self._swap_in_summary(epoch, turns, summary_text)
         except Exception as e:
-            print(f"❌ Compression Failed: {e}")
\ No newline at end of file
+            print(f"❌ Background Compression Failed: {e}")
+        finally:
+            self._compressing = False
+
+    def _swap_in_summary(self, epoch, turns, summary_text):
+        """
+        Internal helper: atomically replaces the folded turns with the new summary.
+        Turns added while the summary was being written are kept as they are.
+        """
+        with self._lock:
+            if epoch != self._memory_epoch:
+                return # memory was wiped / replaced meanwhile, this summary is stale
+
+            # Everything after the newest folded turn is kept (the window may have dropped some folded turns already)
+            last_folded = turns[-1]
+            keep_from = self._pinned
+            for i in range(len(self.history) - 1, self._pinned - 1, -1):
+                if self.history[i] is last_folded:
+                    keep_from = i + 1
+                    break
+
+            if self.memory is not None:
+                self.memory.evict(self.history[self._pinned:keep_from])
+            self.history = [
+                {"role": "system", "content": self.system_prompt_content},
+                {"role": "assistant", "content": f"MEMORY CONTEXT: {summary_text}"}
+            ] + self.history[keep_from:]
+            self.summary = summary_text
+            self._pinned = 2
+            self._recount_tokens()
+            if self.store is not None:
+                self.store.set_summary(self.session_id, summary_text, keep=len(self.history) - self._pinned)
@@ -0,0 +1,142 @@
+### STATE GATE
+# Used by ros_brain_node.py to skip LLM calls for sensor states that are effectively unchanged.
+# Sensors publish far faster than a 14B model can plan, and most consecutive states differ only by
+# noise or a timestamp. The gate compares each new state with the last one sent to the brain and
+# only lets it through on a significant change, or once the last plan is older than max_age.
+# we have StateGate --> check(data) decides plan/skip, failed(data) re-opens the gate after a failed call
+# we have flatten --> {"pose": {"x": 1}} --> {"pose.x": 1}, the field paths tolerances and ignores refer to
+#
+# Usage:
+#     gate = StateGate(tolerances={"battery": 5, "pose": 0.2}, ignored={"header.stamp"}, max_age=10)
+#     if gate.check(msg.data) is not None:
+#         ... ask the brain ...
+
+import json
+import threading
+import time
+
+
+def flatten(value, prefix=""):
+    """Nested JSON as {dotted.path: leaf value} (list items are numbered: "ranges.0", "ranges.1"...)."""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return {prefix: value}
+    flat = {}
+    for key, item in items:
+        flat.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+    if not flat and prefix:
+        flat[prefix] = value  # an empty dict/list is a value of its own
+    return flat
+
+
+def _is_number(value):
+    # bool is a subclass of int in Python, but a flag, not a measurement
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class StateGate:
+    """
+    Decides which sensor states are worth a new plan.
+    :param tolerances: {field path: max absolute change ignored}. An entry also covers everything inside
+                       that field ("pose" covers "pose.x" and "pose.y"); the most specific entry wins.
+    :param ignored: Field paths never compared (timestamps, sequence numbers...), also covering what's inside.
+    :param default_tolerance: Tolerance of numeric fields without an entry (0 = any change counts).
+                              Non-numeric fields always have to match exactly.
+    :param max_age: Seconds after which the state is planned again even if nothing changed (None = never).
+    """
+    def __init__(self, tolerances=None, ignored=(), default_tolerance=0.0, max_age=10.0, clock=time.monotonic):
+        self.tolerances = dict(tolerances or {})
+        self.ignored = set(ignored)
+        self.default_tolerance = default_tolerance
+        self.max_age = max_age
+        self.clock = clock
+        self.stats = {"received": 0, "planned": 0, "skipped": 0, "stale": 0, "failed": 0}
+        self._lock = threading.Lock()
+        self._reference = None      # (raw data, flattened state) last let through
+        self._reference_time = None
+
+    def _lookup(self, path):
+        """The most specific tolerance for path (None = ignored)."""
+        parts = path.split(".")
+        for end in range(len(parts), 0, -1):
+            key = ".".join(parts[:end])
+            if key in self.ignored:
+                return None
+            if key in self.tolerances:
+                return self.tolerances[key]
+        return self.default_tolerance
+
+    def changed_field(self, old, new):
+        """First field (path) that differs significantly between two flattened states, or None."""
+        for path in old.keys() | new.keys():
+            tolerance = self._lookup(path)
+            if tolerance is None:
+                continue
+            if path not in old or path not in new:
+                return path
+            a, b = old[path], new[path]
+            if _is_number(a) and _is_number(b):
+                if abs(a - b) > tolerance:
+                    return path
+            elif a != b:
+                return path
+        return None
+
+    def check(self, data):
+        """
+        Decides whether the state `data` (JSON text) needs the brain.
+        Returns why it does ("first", "unparsable", "stale", "changed: <field>"), or None to skip it.
+        A state that is let through becomes the new reference the next ones are compared with.
+        """
+        try:
+            state = flatten(json.loads(data))
+        except ValueError:
+            state = None
+        now = self.clock()
+        with self._lock:
+            self.stats["received"] += 1
+            if self._reference is None:
+                reason = "first"
+            elif state is None:
+                reason = "unparsable"  # can't judge it: let the brain see it
+            elif self.max_age is not None and now - self._reference_time >= self.max_age:
+                reason = "stale"
+                self.stats["stale"] += 1
+            else:
+                field = self.changed_field(self._reference[1], state) if self._reference[1] is not None else "state"
+                reason = f"changed: {field}" if field is not None else None
+
+            if reason is None:
+                self.stats["skipped"] += 1
+                return None
+            self.stats["planned"] += 1
+            self._reference = (data, state)
+            self._reference_time = now
+            return reason
+
+    @property
+    def reference(self):
+        """The data (as passed to check) that unchanged states are compared with, None before the first."""
+        reference = self._reference
+        return reference[0] if reference is not None else None
+
+    def failed(self, data):
+        """The call for `data` failed: the next state goes through, instead of being compared with it."""
+        with self._lock:
+            self.stats["failed"] += 1
+            if self._reference is not None and self._reference[0] is data:
+                self._reference = None
+
+    @property
+    def skip_rate(self):
+        """Share of received states that didn't need a call."""
+        received = self.stats["received"]
+        return self.stats["skipped"] / received if received else 0.0
+
+    def summary(self):
+        s = self.stats
+        return (f"🚦 Gate: {s['received']} states, {s['planned']} planned ({s['stale']} for staleness), "
+                f"{s['skipped']} skipped ({self.skip_rate:.0%}), {s['failed']} failed")
@@ -0,0 +1,139 @@
+### STRUCTURED (JSON) OUTPUT HELPERS
+# Used by SovereignClient.chat_json, which asks Ollama for JSON via its "format" field.
+# we have validate --> checks a parsed reply against a (small subset of) JSON Schema
+# we have IncrementalJSONParser --> reads a streamed JSON object and hands out each top-level
+#                                   field as soon as it is complete (act on "action" before "reasoning" is done)
+# No extra dependencies: only the schema keywords we actually use are supported
+# (type, properties, required, items, enum, additionalProperties).
+
+import json
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def _type_matches(value, type_name):
+    # bool is a subclass of int in Python, but not a number in JSON
+    if type_name in ("number", "integer") and isinstance(value, bool):
+        return False
+    return isinstance(value, _TYPES[type_name])
+
+
+def validate(value, schema, path="$"):
+    """
+    Checks value against schema.
+    Returns a list of error strings (empty list = valid).
+    """
+    errors = []
+
+    expected = schema.get("type")
+    if expected is not None:
+        names = expected if isinstance(expected, list) else [expected]
+        if not any(_type_matches(value, name) for name in names):
+            return [f"{path}: expected {expected}, got {type(value).__name__}"]
+
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: missing required field '{key}'")
+        for key, item in value.items():
+            if key in properties:
+                errors.extend(validate(item, properties[key], f"{path}.{key}"))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected field '{key}'")
+
+    if isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]"))
+
+    return errors
+
+
+def strip_fences(text):
+    """Removes Markdown code fences the AI sometimes wraps JSON in."""
+    return text.replace("```json", "").replace("```", "").strip()
+
+
+class IncrementalJSONParser:
+    """
+    Feeds on streamed text of ONE JSON object and returns its top-level fields as they complete.
+
+    Usage:
+        parser = IncrementalJSONParser()
+        for token in stream:
+            for key, value in parser.feed(token):
+                print(key, value)
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.fields = {}
+        self._pos = 0            # next character of buffer to scan
+        self._depth = 0          # nesting depth ({ and [)
+        self._in_string = False
+        self._escape = False
+        self._key_start = None   # where the current top-level key string starts
+        self._key = None         # current top-level key, once read
+        self._value_start = None # where its value starts (just after the ':')
+
+    def feed(self, text):
+        """Adds more text. Returns a list of (key, value) pairs completed by it."""
+        self.buffer += text
+        completed = []
+        buf = self.buffer
+
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = json.loads(buf[self._key_start:i + 1])
+                        self._key_start = None
+                continue
+
+            if c == '"':
+                self._in_string = True
+                # A string at the top level that isn't a value must be a key
+                if self._depth == 1 and self._key is None:
+                    self._key_start = i
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                if self._depth == 1:
+                    self._complete_field(buf, i, completed)
+                self._depth -= 1
+            elif self._depth == 1 and c == ":":
+                self._value_start = i + 1
+            elif self._depth == 1 and c == ",":
+                self._complete_field(buf, i, completed)
+
+        self._pos = len(buf)
+        return completed
+
+    def _complete_field(self, buf, end, completed):
+        if self._key is not None and self._value_start is not None:
+            try:
+                value = json.loads(buf[self._value_start:end])
+            except ValueError:
+                value = None  # broken value: left for the final json.loads to report
+            else:
+                self.fields[self._key] = value
+                completed.append((self._key, value))
+        self._key = None
+        self._value_start = None
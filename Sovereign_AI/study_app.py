@@ -1,18 +1,26 @@
 import os
 import sys
+import threading
 # Import the class we just created
 from sovereign_client import SovereignClient
+from conversation_store import SQLiteStore
+from errors import SovereignError
+from model_cascade import ModelCascade, CascadeRule
+from telemetry import Telemetry
 
 # =========================================================
 # ⚠️ CONFIGURATION: Update server_url.txt with your ngrok URL
 # =========================================================
 def load_server_url():
-    """Load server URL from server_url.txt file"""
+    """
+    Load server URL(s) from server_url.txt file.
+    One URL per line: with several, turns are routed between them and fail over if one goes down.
+    """
     try:
         with open('server_url.txt', 'r') as f:
-            url = f.read().strip()
-            if url:
-                return url
+            urls = [line.strip() for line in f if line.strip()]
+            if urls:
+                return urls if len(urls) > 1 else urls[0]
             else:
                 print("❌ ERROR: server_url.txt is empty")
                 sys.exit(1)
@@ -21,32 +29,171 @@ def load_server_url():
         sys.exit(1)
 
 SERVER_URL = load_server_url()
+# Every session is saved here, so picking the same mode + topic again carries on where you left off
+SESSIONS_DB = "study_sessions.db"
+# Exam mode: generate the next question while you type your answer (then only the grading is waited for)
+PREFETCH_EXAM_QUESTIONS = True
+# Temperature of the exam (questions and grading): low, so grades are consistent
+EXAM_TEMPERATURE = 0.2
+# Model cascade: a small model answers first, the 14B only what it can't (None = everything goes to the 14B).
+# Pull it on the server too:  ollama pull qwen2.5:3b
+CASCADE_MODEL = None
+CASCADE_RULES = {
+    "Socratic Tutor": CascadeRule(max_reply_tokens=200),  # hints and short questions
+    "Examiner": CascadeRule(enabled=False),               # grading has to be right
+}
 # =========================================================
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
+def print_token(token):
+    """Prints streamed tokens live as they arrive from the server."""
+    print(token, end="", flush=True)
+
+def say(bot, user_input, temperature=0.7, instruction=None):
+    """Streams one AI reply to the screen. Returns it, or None if the turn failed (it is then not kept)."""
+    print("AI: ", end="", flush=True)
+    try:
+        reply = bot.chat(user_input, temperature=temperature, on_token=print_token, instruction=instruction)
+    except SovereignError as e:
+        print(f"\n❌ {e}\n   (Nothing was kept, just send it again.)")
+        return None
+    print()
+    return reply
+
+def print_breakdown(metrics):
+    """Telemetry hook: shows where the time of each turn went (enabled with /stats)."""
+    print(f"\n   ⏱️ {metrics.breakdown()}", end="")
+
+class QuestionPrefetcher:
+    """
+    Exam mode speed-up. While you type your answer, the next question is generated in the
+    background on a forked copy of the conversation. Your answer then only needs grading,
+    and the ready question is spliced into the conversation right after the grade.
+    A prefetch is discarded if the conversation changed before it was used (/undo, /wipe...).
+    """
+    # Sent with the answer as a one-off instruction: it never ends up in the saved conversation
+    GRADE_ONLY = "Grade the user's answer 0-10 and explain the correction. Do not ask the next question yet."
+
+    def __init__(self, bot, topic, temperature=EXAM_TEMPERATURE):
+        self.bot = bot
+        self.topic = topic
+        self.temperature = temperature
+        self.stats = {"prefetched": 0, "used": 0, "discarded": 0, "failed": 0, "wasted_tokens": 0}
+        self._lock = threading.Lock()
+        self._job = None
+
+    def start(self):
+        """Forks the conversation and starts generating the next question in the background."""
+        self.discard()
+        if not self.bot.history or self.bot.history[-1]["role"] != "assistant":
+            return # no question on screen to prefetch after
+        # Own telemetry: background calls shouldn't print /stats lines while you type
+        fork = self.bot.fork(telemetry=Telemetry())
+        job = {"basis": self.bot.history[-1], "question": None, "discarded": False, "done": threading.Event()}
+
+        def run():
+            try:
+                reply = fork.chat(f"Ask me the next question about {self.topic}. Reply with the question only.",
+                                  temperature=self.temperature)
+            except SovereignError:
+                reply = None
+            tokens = (fork.last_metrics.eval_count or 0) if fork.last_metrics is not None else 0
+            with self._lock:
+                if reply is None:
+                    self.stats["failed"] += 1
+                elif job["discarded"]:
+                    self.stats["wasted_tokens"] += tokens # nobody will use it
+                else:
+                    job["question"] = reply
+                    job["tokens"] = tokens
+            job["done"].set()
+
+        self.stats["prefetched"] += 1
+        self._job = job
+        threading.Thread(target=run, daemon=True).start()
+
+    def ready_for(self, bot):
+        """True if a prefetch is running/done for the conversation as it is now."""
+        return self._job is not None and bool(bot.history) and bot.history[-1] is self._job["basis"]
+
+    def take(self):
+        """Waits for the prefetched question and hands it over (None if it failed)."""
+        job, self._job = self._job, None
+        job["done"].wait()
+        if job["question"] is not None:
+            self.stats["used"] += 1
+        return job["question"]
+
+    def discard(self):
+        """Drops the current prefetch without waiting for it (its tokens count as wasted)."""
+        job, self._job = self._job, None
+        if job is None:
+            return
+        with self._lock:
+            job["discarded"] = True
+            self.stats["discarded"] += 1
+            if job["question"] is not None: # already finished
+                self.stats["wasted_tokens"] += job["tokens"]
+
+    def summary(self):
+        s = self.stats
+        return (f"🔮 Prefetch: {s['used']}/{s['prefetched']} questions used, {s['discarded']} discarded "
+                f"({s['wasted_tokens']} tokens wasted), {s['failed']} failed")
+
+
+def answer_exam_question(bot, prefetcher, user_input):
+    """
+    Exam turn with a prefetched next question: stream the grade, then splice the ready question in.
+    Returns False if grading failed (the question is still open and its prefetch still valid).
+    """
+    if say(bot, user_input, temperature=prefetcher.temperature, instruction=QuestionPrefetcher.GRADE_ONLY) is None:
+        return False
+    question = prefetcher.take()
+    if question is not None:
+        print(f"\n{question}")
+        bot.extend_last_reply(f"\n\n{question}")
+    else:
+        # Prefetch failed: ask for the next question the normal way
+        print()
+        say(bot, f"Ask me the next question about {prefetcher.topic}.", temperature=prefetcher.temperature)
+    return True
+
+
 def main():
     clear_screen()
     print("🎓 SOVEREIGN STUDY COMPANION (v2.0)")
     print("-----------------------------------")
     print("Type '/undo' to fix mistakes.")
     print("Type '/compress' to save memory.")
-    print("Type '/wipe' to remove memory.")
+    print("Type '/wipe' to remove memory (and start this topic over).")
+    print("Type '/stats' to show/hide the latency of each reply.")
     print("Type '/quit' to exit.")
     print("-----------------------------------")
     
     # 1. Initialize
-    bot = SovereignClient(SERVER_URL)
+    cascade = ModelCascade(CASCADE_MODEL, rules=CASCADE_RULES) if CASCADE_MODEL else None
+    bot = SovereignClient(SERVER_URL, cascade=cascade)
+    show_stats = False
     
-    # 2. Connection Check
+    # 2. Connection Check (metadata only: no GPU time, nothing added to the conversation)
     print("📡 Connecting to Brain...", end="\r")
-    response = bot.chat("Are you online? Reply with 'Ready'.")
-    if "Error" in response:
-        print(f"\n{response}")
+    status = bot.health()
+    if not status["ready"]:
+        errors = [e["error"] for e in status["endpoints"] if e["error"]]
+        if status["reachable"]:
+            print(f"\n❌ The server is up but doesn't have {bot.model}. Run: ollama pull {bot.model}")
+        else:
+            print(f"\n❌ {errors[0] if errors else 'Cannot reach the server.'}")
         print("Check if Google Colab is running and the URL is updated.")
         sys.exit()
     print("✅ System Online & Ready.  \n")
+    if not status["loaded"]:
+        # Load the model into VRAM while you pick a mode, so the first reply doesn't wait for it
+        bot.warm_up()
+    # Attached here, not passed to the constructor (which would start an empty session before a mode is picked)
+    bot.store = SQLiteStore(SESSIONS_DB)
 
     # 3. Mode Selection
     while True:
@@ -66,30 +213,47 @@ def main():
             topic = input("Enter Topic (e.g., 'Op-Amps', 'Calculus'): ")
 
         # --- POWER CUSTOMIZATION ---
+        # Each mode + topic is its own saved session: resumed if you studied it before
+        session_id = f"mode{choice}:{topic.strip().lower()}"
         if choice == "1":
-            bot.set_persona(
+            resumed = bot.open_session(session_id,
                 f"You are a Socratic Tutor teaching {topic}. "
                 "Never explain the concept directly. "
                 "Ask one simple question at a time to lead the user to the answer. "
                 "If they are wrong, give a hint."
             )
             print(f"\n--- SOCRATIC SESSION: {topic} ---")
-            print(f"AI: Let's begin. What do you already know about {topic}?")
+            if resumed:
+                print(f"📂 Resumed your last session ({resumed} messages).")
+            else:
+                print(f"AI: Let's begin. What do you already know about {topic}?")
             
         elif choice == "2":
-            bot.set_persona(
+            resumed = bot.open_session(session_id,
                 f"You are a strict Examiner for {topic}. "
                 "Ask a hard technical question. Wait for the answer. "
                 "Then grade it 0-10, explain the correction, and ask the next question."
             )
             print(f"\n--- EXAM SESSION: {topic} ---")
-            print(f"AI: I am generating your first question on {topic}...")
-            # Trigger the first question
-            print(bot.chat(f"Ask me the first question about {topic}."))
+            if resumed:
+                print(f"📂 Resumed your last session ({resumed} messages).")
+            else:
+                # Trigger the first question (streamed live)
+                say(bot, f"Ask me the first question about {topic}.", temperature=EXAM_TEMPERATURE)
 
         elif choice == "3":
-            bot.set_persona("You are a helpful, sarcastic engineering assistant.")
+            resumed = bot.open_session(session_id, "You are a helpful, sarcastic engineering assistant.")
             print("\n--- FREE CHAT ---")
+            if resumed:
+                print(f"📂 Resumed your last session ({resumed} messages).")
+
+        else:
+            continue
+
+        prefetcher = None
+        if choice == "2" and PREFETCH_EXAM_QUESTIONS:
+            prefetcher = QuestionPrefetcher(bot, topic)
+            prefetcher.start()
 
         # 4. The Conversation Loop (With Magic Commands)
         while True:
@@ -113,16 +277,35 @@ def main():
                     print("Memory cleared.")
                     continue
                 
-                # Normal Message Handling
-                print("Thinking...", end="\r")
-                temp = 0.2 if choice == "2" else 0.7
-                reply = bot.chat(user_input, temperature=temp)
+                elif user_input.lower() == '/stats':
+                    show_stats = not show_stats
+                    if show_stats:
+                        bot.telemetry.add_hook(print_breakdown)
+                    else:
+                        bot.telemetry.remove_hook(print_breakdown)
+                    print(f"Latency breakdown {'ON' if show_stats else 'OFF'}.")
+                    continue
+                
+                # Exam answer with the next question already prefetched
+                if prefetcher is not None and prefetcher.ready_for(bot):
+                    if answer_exam_question(bot, prefetcher, user_input):
+                        prefetcher.start()
+                    continue
                 
-                print(" " * 20, end="\r")
-                print(f"AI: {reply}")
+                # Normal Message Handling (tokens are printed as they stream in)
+                temp = EXAM_TEMPERATURE if choice == "2" else 0.7
+                say(bot, user_input, temperature=temp)
+                if prefetcher is not None:
+                    prefetcher.start()
                 
             except KeyboardInterrupt:
                 break
 
+        if prefetcher is not None:
+            prefetcher.discard()
+            print(prefetcher.summary())
+        if cascade is not None:
+            print(cascade.summary())
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
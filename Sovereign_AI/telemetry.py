@@ -0,0 +1,249 @@
+### TELEMETRY
+# Per-call performance numbers for SovereignClient.
+# Ollama reports how long it spent on each phase of a request (nanoseconds):
+#   total_duration, load_duration (loading the model into VRAM), prompt_eval_count/_duration
+#   (reading the prompt), eval_count/_duration (generating the reply).
+# We combine them with the client-side wall time, so the difference is what the
+# request spent queueing and travelling through the ngrok tunnel.
+# Behind the priority gateway, its queueing time comes back in the X-Queue-Wait header,
+# so queueing and tunnel time can be told apart.
+# we have TurnMetrics --> the breakdown of one call (bot.last_metrics)
+# we have Telemetry --> rolling histograms + counters over all calls (bot.telemetry),
+#                       hooks called after every turn, and a Prometheus text exporter
+
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+NS = 1e9
+
+QUEUE_WAIT_HEADER = "X-Queue-Wait"
+
+# Histogram buckets in seconds (Prometheus style, cumulative)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class TurnMetrics:
+    """Latency breakdown of one call. Times are in seconds, None when the server didn't report them."""
+    __slots__ = ("network_time", "ttft", "total_duration", "load_duration", "prompt_eval_count",
+                 "prompt_eval_duration", "eval_count", "eval_duration", "model", "queue_wait")
+
+    def __init__(self, network_time, ttft=None, data=None, model=None, queue_wait=None):
+        data = data or {}
+        self.network_time = network_time
+        self.ttft = ttft
+        self.queue_wait = queue_wait  # seconds spent in the server gateway's queue (None = no gateway)
+        self.model = data.get("model", model)
+        self.total_duration = _seconds(data.get("total_duration"))
+        self.load_duration = _seconds(data.get("load_duration"))
+        self.prompt_eval_count = data.get("prompt_eval_count")
+        self.prompt_eval_duration = _seconds(data.get("prompt_eval_duration"))
+        self.eval_count = data.get("eval_count")
+        self.eval_duration = _seconds(data.get("eval_duration"))
+
+    @property
+    def tokens_per_second(self):
+        """Generation speed on the GPU."""
+        if self.eval_count and self.eval_duration:
+            return self.eval_count / self.eval_duration
+        return None
+
+    @property
+    def overhead(self):
+        """Client wall time the server didn't account for: queueing, tunnel, HTTP."""
+        if self.total_duration is None:
+            return None
+        return max(0.0, self.network_time - self.total_duration)
+
+    def as_dict(self):
+        result = {name: getattr(self, name) for name in self.__slots__}
+        result["tokens_per_second"] = self.tokens_per_second
+        result["overhead"] = self.overhead
+        return result
+
+    def breakdown(self):
+        """One-line human readable latency breakdown, for logs."""
+        parts = []
+        if self.ttft is not None:
+            parts.append(f"ttft {self.ttft:.2f}s")
+        if self.overhead is not None and self.queue_wait is not None:
+            parts.append(f"queue {self.queue_wait:.2f}s")
+            parts.append(f"tunnel {max(0.0, self.overhead - self.queue_wait):.2f}s")
+        elif self.overhead is not None:
+            parts.append(f"queue/tunnel {self.overhead:.2f}s")
+        if self.load_duration:
+            parts.append(f"load {self.load_duration:.2f}s")
+        if self.prompt_eval_duration is not None:
+            parts.append(f"prompt {self.prompt_eval_count} tok in {self.prompt_eval_duration:.2f}s")
+        if self.tokens_per_second is not None:
+            parts.append(f"gen {self.eval_count} tok @ {self.tokens_per_second:.1f} tok/s")
+        parts.append(f"total {self.network_time:.2f}s")
+        return " | ".join(parts)
+
+
+def _seconds(ns):
+    return ns / NS if ns is not None else None
+
+
+def queue_wait_from(headers):
+    """The gateway's X-Queue-Wait header in seconds, or None when there is no gateway."""
+    value = headers.get(QUEUE_WAIT_HEADER)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class Histogram:
+    """
+    Cumulative bucket counts (for Prometheus) plus a rolling window of recent samples (for percentiles).
+    Recording is O(buckets), with no allocation beyond the fixed-size window.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1000):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot = +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, q):
+        """q in 0..1 over the rolling window. None if empty."""
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Telemetry:
+    """
+    Aggregated metrics for one or more clients (pass the same Telemetry to several clients to share it).
+
+    Usage:
+        bot.telemetry.add_hook(lambda m: print(m.breakdown()))
+        print(bot.telemetry.summary())
+        print(bot.telemetry.to_prometheus())
+    """
+    HISTOGRAMS = {
+        "request_seconds": "Client wall time per request",
+        "ttft_seconds": "Time to first token (streamed requests)",
+        "prompt_eval_seconds": "Server time spent reading the prompt",
+        "overhead_seconds": "Queueing + tunnel time (client time not spent on the server)",
+        "queue_wait_seconds": "Time spent in the server gateway's queue",
+        "tokens_per_second": "Generation speed",
+    }
+    COUNTERS = {
+        "requests_total": "Completed requests",
+        "errors_total": "Failed requests",
+        "hedges_total": "Duplicate requests sent because the first one was slower than usual",
+        "hedge_wins_total": "Hedged requests where the duplicate answered first",
+        "prompt_tokens_total": "Prompt tokens evaluated by the server",
+        "generated_tokens_total": "Tokens generated by the server",
+        "load_seconds_total": "Time the server spent loading the model",
+    }
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self.histograms = {name: Histogram(window=window) for name in self.HISTOGRAMS}
+        self.histograms["tokens_per_second"] = Histogram(buckets=(1, 5, 10, 20, 40, 80, 160), window=window)
+        self.counters = {name: 0 for name in self.COUNTERS}
+        self._hooks = []
+
+    def add_hook(self, hook):
+        """hook(TurnMetrics) is called after every successful turn."""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def record(self, metrics):
+        with self._lock:
+            self.counters["requests_total"] += 1
+            self.histograms["request_seconds"].observe(metrics.network_time)
+            if metrics.ttft is not None:
+                self.histograms["ttft_seconds"].observe(metrics.ttft)
+            if metrics.prompt_eval_duration is not None:
+                self.histograms["prompt_eval_seconds"].observe(metrics.prompt_eval_duration)
+            if metrics.overhead is not None:
+                self.histograms["overhead_seconds"].observe(metrics.overhead)
+            if metrics.queue_wait is not None:
+                self.histograms["queue_wait_seconds"].observe(metrics.queue_wait)
+            if metrics.tokens_per_second is not None:
+                self.histograms["tokens_per_second"].observe(metrics.tokens_per_second)
+            self.counters["prompt_tokens_total"] += metrics.prompt_eval_count or 0
+            self.counters["generated_tokens_total"] += metrics.eval_count or 0
+            self.counters["load_seconds_total"] += metrics.load_duration or 0
+        for hook in self._hooks:
+            hook(metrics)
+
+    def record_error(self):
+        with self._lock:
+            self.counters["errors_total"] += 1
+
+    def record_hedge(self, won=False):
+        """Counts a duplicate request (call again with won=True if the duplicate answered first)."""
+        with self._lock:
+            self.counters["hedge_wins_total" if won else "hedges_total"] += 1
+
+    def summary(self):
+        """Counters plus p50/p95/p99 of every histogram over the rolling window."""
+        with self._lock:
+            result = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                for q in (0.5, 0.95, 0.99):
+                    result[f"{name}_p{int(q * 100)}"] = histogram.percentile(q)
+        return result
+
+    def to_prometheus(self, prefix="sovereign_client"):
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, help_text in self.COUNTERS.items():
+                metric = f"{prefix}_{name}"
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter",
+                          f"{metric} {self.counters[name]}"]
+            for name, help_text in self.HISTOGRAMS.items():
+                histogram = self.histograms[name]
+                metric = f"{prefix}_{name}"
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port=9464, host="0.0.0.0"):
+        """
+        OPTIONAL: serves to_prometheus() at http://host:port/metrics from a background thread.
+        Returns the server (call .shutdown() to stop it).
+        """
+        telemetry = self
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = telemetry.to_prometheus().encode()
+                self.send_response(200 if self.path == "/metrics" else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server